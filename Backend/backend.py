@@ -3,7 +3,7 @@ import sys
 
 from polars import date
 from dbcontext import *
-from sqlalchemy import and_
+from sqlalchemy import and_, bindparam, update
 from sqlalchemy.exc import IntegrityError
 from pymysql.err import IntegrityError as pymysql_IntegrityError
 from flask import Flask, Response, jsonify, request
@@ -11,16 +11,32 @@ from flask_cors import CORS
 import db_seed
 from sqlalchemy.sql import operators
 import models
+import loaders
+import serializers
+import pagination
+import streaming
+import columnar
+import cache
+import compression
+import hashing
+import bulk
+import images
+import thumbnails
+import search
+import similarity
+import snapshot
+import query_stats
+import metrics
+import rollups
+import index_advisor
 import os
-import uuid
-from flask_bcrypt import Bcrypt
+import time
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, set_access_cookies, unset_jwt_cookies, unset_access_cookies, verify_jwt_in_request
 from functools import wraps
 from datetime import timedelta
 
 # Initialize database context and Flask app
-dbcontext = DatabaseContext.get_instance()   # Create an instance of the DatabaseContext class
-dbcontext.clear_database()      # Clear the database, to avoid duplicate data when populating
+dbcontext = DatabaseContext.get_instance()   # Create an instance of the DatabaseContext class, creates missing tables
 app = Flask(__name__)           # Initialize a Flask app instance
 cors = CORS(app)
 CORS(
@@ -28,7 +44,8 @@ CORS(
     supports_credentials=True,
     methods=["GET","PUT","POST","DELETE","UPDATE", "OPTIONS"],
     origins="http://localhost:5173",
-    allow_headers=["Content-Type"],
+    allow_headers=["Content-Type", "If-None-Match"],
+    expose_headers=["ETag"],
 )
 
 @app.after_request
@@ -36,10 +53,24 @@ def creds(response):
     response.headers['Access-Control-Allow-Credentials'] = 'true'
     response.headers["Access-Control-Allow-Methods"] = "GET, PUT, POST, DELETE, UPDATE, OPTIONS"
     response.headers["Access-Control-Allow-Origin"] = "http://localhost:5173"
-    response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization"
+    response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization, If-None-Match"
+    response.headers["Access-Control-Expose-Headers"] = "ETag"
     return response
 
-bcrypt = Bcrypt(app)
+@app.before_request
+def start_request_metrics():
+    metrics.begin(request.endpoint or "unmatched", request.method, request.path) # Latency, SQL and serialization of the request, see metrics.py
+
+@app.after_request
+def finish_request_metrics(response):
+    metrics.end(response.status_code)
+    return response
+
+@app.teardown_appcontext
+def remove_session(exception):
+    dbcontext.remove_request_session() # Return the request's connection to the pool
+
+password_hasher = hashing.PasswordHasher() # bcrypt in a process pool, see hashing.py
 app.config['JWT_VERIFY_SUB'] = False
 app.config['JWT_SECRET_KEY'] = 'asd'
 app.config['JWT_TOKEN_LOCATION'] = ['cookies']
@@ -51,14 +82,102 @@ app.config["JWT_CSRF_IN_COOKIES"] = False
 app.config["JWT_COOKIE_SAMESITE"] = "None"
 jwt = JWTManager(app)
 
+app.config['RESULT_CACHE_BYTES'] = int(os.environ.get('RESULT_CACHE_BYTES', 32 * 1024 * 1024))
+app.config['ARROW_COMPRESSION'] = os.environ.get('ARROW_COMPRESSION', 'zstd') # Buffer compression of "format": "arrow" responses, see columnar.py
+PRODUCT_INDEXES = "product_indexes"  # version of the catalog, as far as the search and similarity indexes are concerned
+table_versions = cache.TableVersions([*Base.metadata.tables, PRODUCT_INDEXES, snapshot.STOCK])  # bumped by every write, shared by the workers, see cache.py
+result_cache = cache.ResultCache(table_versions, app.config['RESULT_CACHE_BYTES'])  # serialized read results
+search_index = search.SearchIndex()  # product and manufacturer names, see search.py
+similarity_index = similarity.SimilarityIndex()  # nearest products by nutrition, see similarity.py
+catalog_snapshot = snapshot.CatalogSnapshot(table_versions)  # products with details as a polars frame, see snapshot.py
+query_usage = query_stats.QueryUsage()  # filtered columns and operators, frequency and latency, see index_advisor.py
+response_compressor = compression.Compressor()  # gzip, brotli or zstd for large responses, see compression.py
+
+@app.after_request
+def compress_response(response):
+    return response_compressor.apply(request, response) # Before the request metrics, so they include compressing
+
+def current_index(index, session):
+    """
+    Builds a product index on first use, and rebuilds it if the catalog changed in another worker process
+    since it was built or last updated.
+    """
+    version = table_versions.get(PRODUCT_INDEXES)  # before reading, so writes during the build trigger another one
+    if not index.built or index.version != version:
+        index.build(session)
+        index.version = version
+    return index
+
+def update_product_indexes(registry, ids):
+    """
+    Reindexes written products, manufacturers or product details, so search results and recommendations stay current.
+    An index that missed a write from another worker is rebuilt on its next query instead.
+    """
+    if registry.table not in ("product", "manufacturer", "product_details"):
+        return
+    version = table_versions.bump(PRODUCT_INDEXES)[PRODUCT_INDEXES]
+    with dbcontext.get_session() as S:
+        for index in (search_index, similarity_index):
+            if not index.built or index.version != version - 1:
+                index.invalidate()
+                continue
+            if registry.table == "product":
+                index.update_products(S, ids)
+            elif registry.table == "manufacturer":
+                index.update_manufacturers(S, ids)
+            else:
+                index.update_details(S, ids)
+            index.version = version
+
+def invalidate_product_indexes(registry):
+    """
+    Marks the indexes of every worker for a rebuild, after a write that doesn't report its ids.
+    """
+    if registry.table in ("product", "manufacturer", "product_details"):
+        table_versions.bump(PRODUCT_INDEXES)
+
 IMAGE_FOLDER = os.path.join(os.getcwd(), 'static', 'images')
 app.config['IMAGE_FOLDER'] = IMAGE_FOLDER
 os.makedirs(IMAGE_FOLDER, exist_ok=True)
+thumbnail_cache = thumbnails.ThumbnailCache(IMAGE_FOLDER, os.path.join(os.getcwd(), 'static', 'thumbnails')) # resized images, see thumbnails.py
 allowed_image_extensions = {'jpg', 'jpeg'}
 
 def validate_image_extention(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_image_extensions
 
+def save_image(img):
+    """
+    Stores an uploaded image under the hash of its content, see images.py.
+
+    Returns:
+        str: Path of the image, to store in Product.image.
+    """
+    if img and validate_image_extention(img.filename):
+        return images.store_upload(img, app.config['IMAGE_FOLDER'])
+    raise Exception('invalid image')
+
+@app.route('/static/images/<path:filename>', endpoint='image')
+def image(filename):
+    """
+    Serves product images. Uploaded images are content addressed, and cached by clients as immutable.
+    """
+    return images.send_image(app.config['IMAGE_FOLDER'], filename)
+
+@app.route('/api/image/<path:image>', methods=['GET'], endpoint='resized_image')
+def resized_image(image):
+    """
+    Serves a resized product image, e.g. /api/image/static/images/Trix.jpg?preset=grid or ?width=480.
+    Variants are generated once and kept in a size bounded disk cache.
+    """
+    try:
+        return thumbnail_cache.send(image, request.args.get('preset'), request.args.get('width'))
+    except FileNotFoundError:
+        return "Image not found", 404
+    except thumbnails.ResizeUnavailable as e:
+        return str(e), 501 # Resizing isn't available on this server
+    except Exception as e:
+        return str(e), 400 # Return error message with 400 status code
+
 operator_map = {     # dictionary to look up operators from a string
     '>': operators.gt,
     '<': operators.lt,
@@ -73,7 +192,12 @@ operator_map = {     # dictionary to look up operators from a string
 
 default_operator = '=='
 
-def filter_build(table, lst):
+def filter_build(table, lst, predicates: list = None):
+    """
+    Builds SQLAlchemy filters from JSON filters, see the example below.
+    If predicates is given, (column, operator, value) of every filter is appended to it for query_usage.
+    """
+    registry = models.TABLES_GET(table.__tablename__)  # column lookup for the table class
     filters = []
     for key, value in lst:
         if isinstance(value, list):
@@ -82,7 +206,12 @@ def filter_build(table, lst):
             operator = default_operator
 
         if operator in operator_map:
-            column = getattr(table, key)
+            table_column = registry.get_column(key)  # accepts column names and mapper names (e.g. manufacturer -> manufacturer_id)
+            if table_column is None:
+                raise ValueError(f"Invalid filter key: {key}")
+            column = table_column.inst
+            if predicates is not None:
+                predicates.append((table_column.name, operator, value))
             if operator == 'range':
                 if isinstance(value, list):
                     start, end = value
@@ -108,65 +237,63 @@ filter = {
 def populateDB():
     print("Populating database")
     with dbcontext.get_session() as S:  # Start a session with the database
-        S.add_all(db_seed.create_customers())
-
-        manufacturers, products = db_seed.create_manufacturers_and_products()
-        S.add_all(manufacturers)
-        S.add_all(products)
-
-        admin_acc = User(
-            email="a@a",
-            name="Bobby",
-            address="Abevej 123",
-            password=bcrypt.generate_password_hash('123').decode('utf-8'),
-            admin=True,
-        )
-        S.add(admin_acc)
-
+        db_seed.seed(S)  # Bulk insert the example data
         S.commit()  # Commit the changes to the database
+
+STARTUP_MODES = ("keep", "seed", "reset")
+
+def init_database(mode: str = None):
+    """
+    Prepares the database on startup. Tables that don't exist yet are always created.
+
+    Args:
+        mode (str): DB_STARTUP from the environment if not given.
+            keep:  leave the existing data alone
+            seed:  populate the database only if it has no products (default)
+            reset: drop all tables, recreate them and populate the database
+    """
+    mode = mode or os.environ.get('DB_STARTUP', 'seed')
+    if mode not in STARTUP_MODES:
+        raise ValueError(f"DB_STARTUP must be one of {', '.join(STARTUP_MODES)}, not {mode}")
+
+    if mode == "reset":
+        dbcontext.clear_database()  # Drop and recreate all tables
+    if mode == "reset" or mode == "seed":
+        with dbcontext.get_session() as S:
+            if db_seed.is_seeded(S):
+                return
+        populateDB()
 #! ..................................
 
 
 def serialize_model(inst: Base, mappers: List[str] = []):
     """
-    Serializes a SQLAlchemy model object into a dictionary, excluding relationship references.
+    Serializes a SQLAlchemy model object into a dictionary, excluding relationship references
+    that aren't listed in mappers.
+    The serializer for each (table, mappers) pair is compiled once and cached, see serializers.py.
 
     Args:
-        obj (Base): SQLAlchemy model object.
+        inst (Base): SQLAlchemy model object.
+        mappers (List[str]): Dotted relationship paths to include, e.g. "orders.order_products".
 
     Returns:
         dict: A dictionary representation of the model.
     """
+    start = time.perf_counter()
+    data = serializers.get_serializer(type(inst), mappers)(inst)
+    metrics.record_serialization(time.perf_counter() - start)
+    return data
 
-    table = models.TABLES_GET(inst.__table__.name)
-
-    serialized_columns = {
-        c.name: getattr(inst, c.name) # Map attribute names to their values
-        for c in table.columns        # Get all columns
-    }
-
-    def serialize_mapper(name, inst, mappers: List[str]):
-        prefix = f"{name}."
-        mappers = [
-            mapper[len(prefix):]
-            for mapper in mappers
-            if mapper.startswith(prefix)
-        ]
-
-        if hasattr(inst, "__iter__"):
-            return [serialize_model(mapper, mappers) for mapper in inst]
-        else:
-            return serialize_model(inst, mappers)
-
-    serialized_mappers = {
-        mapper: serialize_mapper(mapper, getattr(inst, mapper), mappers)
-        for mapper in mappers
-        if hasattr(inst, mapper)
-    }
 
-    serialized_columns.update(serialized_mappers)
-
-    return serialized_columns
+def cached_response(body: Optional[bytes], etag: str, mimetype: str = "application/json") -> Response:
+    """
+    Builds a response for a cacheable read, JSON unless mimetype says otherwise, tagged with its ETag.
+    Without a body, the response is a 304 Not Modified.
+    """
+    response = Response(body, 200 if body is not None else 304, mimetype=mimetype)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache' # clients may store it, but must revalidate with If-None-Match
+    return response
 
 
 def user_required(f):
@@ -175,7 +302,7 @@ def user_required(f):
     """
     @wraps(f)
     def check_user(*args, **kwargs):
-        session = dbcontext.get_session()
+        session = dbcontext.get_request_session()
         user_id = get_jwt_identity().get('id')
         user = session.query(models.User).filter(models.User.id == user_id).first()
         if not user or user.token != request.cookies.get('access_token_cookie'):
@@ -189,7 +316,7 @@ def admin_required(f):
     """
     @wraps(f)
     def check_admin(*args, **kwargs):
-        session = dbcontext.get_session()
+        session = dbcontext.get_request_session()
         table = models.TABLES_GET('user').cls
         user_id = get_jwt_identity().get('id')
         if not session.query(table).filter(table.id == user_id).first().admin:
@@ -204,34 +331,89 @@ def get_items(table_name):
     """
     Acts like get_items, but responds to POST
     Used to bypass limitations on body in get reqquests
+    If the body has limit, order_by or cursor, the response is a page:
+    {"items": [...], "next_cursor": "..."}, see pagination.py
+    If the body has "format": "ndjson" or "json_stream", the rows are streamed in batches, see streaming.py
+    If the body has "format": "columnar" or "arrow", the table is returned column by column, see columnar.py
     """
-    session = dbcontext.get_session()  # Start a new database session
+    session = dbcontext.get_request_session()  # Get the request's database session
     try:
         # Get the table class from on its name
-        table = models.TABLES_GET(table_name).cls
+        registry = models.TABLES_GET(table_name)
+        table = registry.cls
 
         mappers = []
+        page = None
+        format = "json"
+        predicates = []  # filtered and sorted columns, for query_usage
+        filter = []
+        key = ("items", registry.table, "{}", (), format)  # result cache key: table, filter, mappers, format
+        query = session.query(table)
         if request.data:
             if info := request.json:  # Extract extra request info from the request body
                 if "mappers" in info:
                     mappers = info.pop("mappers")
+                format = info.pop("format", format)
+                key = ("items", registry.table, json.dumps(info, sort_keys=True), tuple(mappers), format)
+                page = pagination.Page.from_request(registry, info)
+                if page:
+                    predicates.append((page.order_by.name, "order_by", None))
 
                 # Reformat filter to use as arguments for query
-                filter = filter_build(table, info)
-                # Query the table with the filter
-                data = session.query(table).filter(and_(*filter)).all()
+                filter = filter_build(table, info.items(), predicates)
+                # Query the table with the filter, and_() without arguments is deprecated
+                if filter:
+                    query = query.filter(and_(*filter))
+
+        query = query.options(*loaders.loader_plan(table, mappers))
+        if format in streaming.STREAM_FORMATS:
+            if page:
+                raise ValueError("Streaming can't be combined with pagination")
+            query_usage.record(registry.table, predicates)
+            return streaming.stream_response(query, dbcontext.get_session, mappers, format)
+        elif format in columnar.FORMATS:
+            if page or mappers:
+                raise ValueError(f"The {format} format can't be combined with pagination or mappers")
+        elif format != "json":
+            raise ValueError(f"Unsupported format: {format}")
+        mimetype = columnar.FORMATS.get(format, "application/json")
+
+        snapshot = table_versions.snapshot(cache.dependencies(registry, mappers))  # versions before reading
+        etag = cache.etag(key, snapshot)
+        if request.if_none_match.contains_weak(etag):
+            return cached_response(None, etag, mimetype)
+        if body := result_cache.get(key):
+            return cached_response(body, etag, mimetype)
+
+        start = time.perf_counter()
+        if format in columnar.FORMATS:
+            # Straight from the rows into a polars frame, no model objects or dicts per row
+            frame = columnar.frame(session, table.__table__, filter)
+            query_usage.record(registry.table, predicates, time.perf_counter() - start)
+            start = time.perf_counter()
+            body = columnar.encode(frame, format, app.config['ARROW_COMPRESSION'])
+            metrics.record_serialization(time.perf_counter() - start)
         else:
-            # If no filter, fetch all rows from the table
-            data = session.query(table).all()
-        data = [serialize_model(obj, mappers)
-                for obj in data]  # Serialize the query results
+            rows = page.apply(query).all() if page else query.all()
+            query_usage.record(registry.table, predicates, time.perf_counter() - start)
+            if page:
+                rows, next_cursor = page.result(rows)
+                data = {
+                    "items": serializers.serialize_all(rows, mappers),
+                    "next_cursor": next_cursor,
+                }
+            else:
+                data = serializers.serialize_all(rows, mappers)  # Serialize the query results
     except Exception as e:
         session.rollback()  # Roll back changes if an error occurs
         return str(e), 400  # Return error message with 400 status code
     finally:
         session.commit()  # Commit transaction to database
         session.close()  # Close the session
-    return jsonify(data), 200  # Return serialized data as a JSON responsef
+    if format not in columnar.FORMATS:
+        body = jsonify(data).get_data()
+    result_cache.put(key, snapshot, body)
+    return cached_response(body, etag, mimetype)  # Return serialized data as a JSON responsef
 
 
 @app.route('/api/get/<string:table_name>/<int:id>', methods=['POST'])
@@ -246,8 +428,9 @@ def get_item(table_name, id):
     Returns:
         Response: JSON response containing the queried item.
     """
-    session = dbcontext.get_session() # Start a new database session
-    table = models.TABLES_GET(table_name).cls # Get the table class from on its name
+    session = dbcontext.get_request_session() # Get the request's database session
+    registry = models.TABLES_GET(table_name)
+    table = registry.cls # Get the table class from on its name
     try:
         mappers = []
         if request.data:
@@ -255,7 +438,15 @@ def get_item(table_name, id):
                 if "mappers" in info:
                     mappers = info.pop("mappers")
 
-        data = session.query(table).filter(table.id == id).first() # Query the table for the specific item by its ID
+        key = ("item", registry.table, id, tuple(mappers))  # result cache key: table, id, mappers
+        snapshot = table_versions.snapshot(cache.dependencies(registry, mappers))  # versions before reading
+        etag = cache.etag(key, snapshot)
+        if request.if_none_match.contains_weak(etag):
+            return cached_response(None, etag)
+        if body := result_cache.get(key):
+            return cached_response(body, etag)
+
+        data = session.query(table).options(*loaders.loader_plan(table, mappers)).filter(table.id == id).first() # Query the table for the specific item by its ID, eager loading the mappers
         data = serialize_model(data, mappers) # Serialize the query results
     except Exception as e:
         session.rollback() # Roll back changes if an error occurs
@@ -263,7 +454,9 @@ def get_item(table_name, id):
     finally:
         session.commit() # Commit transaction to database
         session.close() # Close the session
-    return jsonify(data), 200 # Return serialized data as a JSON response
+    response = jsonify(data)
+    result_cache.put(key, snapshot, response.get_data())
+    return cached_response(response.get_data(), etag) # Return serialized data as a JSON response
 
 
 
@@ -277,27 +470,19 @@ def create_item():
     Returns:
         Response: JSON response containing the created item.
     """
-    session = dbcontext.get_session() # Start a new database session
+    session = dbcontext.get_request_session() # Get the request's database session
     try:
         blueprint = dict(request.json.items()) # Extract the update data from request body, and parse it into a dictionary
         if request.files:
-            img = request.files['image']
-            if img and validate_image_extention(img.filename):
-                name = str(uuid.uuid4()) + os.path.splitext(img.filename)[1]
-                path = os.path.join(app.config['IMAGE_FOLDER'], name)
-                img.save(path)
-                blueprint['image'] = f"static/images/{name}"
-            else:
-                raise Exception('invalid image')
+            blueprint['image'] = save_image(request.files['image'])
         else:
-            img = os.path.join(app.config['IMAGE_FOLDER'], 'default.jpg')
-            name = str(uuid.uuid4()) + os.path.splitext(img.filename)[1]
-            path = os.path.join(app.config['IMAGE_FOLDER'], name)
-            blueprint['image'] = f"static/images/{name}"
+            blueprint['image'] = images.DEFAULT_IMAGE
 
-        table = models.TABLES_GET(blueprint.pop("type")).cls
+        registry = models.TABLES_GET(blueprint.pop("type"))
+        table = registry.cls
         item = table(**blueprint)
         session.add(item) # Add the new item to the session
+        session.flush() # Assigns the id
         data = serialize_model(item) # Serialize the created item
     except Exception as e:
         session.rollback() # Roll back changes if an error occurs
@@ -305,6 +490,8 @@ def create_item():
     finally:
         session.commit() # Commit transaction to database
         session.close() # Close the session
+    table_versions.bump(*cache.related(registry)) # Invalidate cached reads of the changed tables
+    update_product_indexes(registry, [data["id"]])
     return jsonify(data), 200 # Return serialized item as a JSON response
 
 
@@ -316,7 +503,7 @@ def order():
     Returns:
         Response: JSON response containing the created item.
     """
-    session = dbcontext.get_session() # Start a new database session
+    session = dbcontext.get_request_session() # Get the request's database session
     try:
         blueprint = dict(request.json.items()) # Extract the update data from request body, and parse it into a dictionary
         order_products = blueprint.pop("order_products")
@@ -333,25 +520,44 @@ def order():
             if user:
                 blueprint["user_id"]=user.id
 
-        blueprint["price"] = 0.0
+        # Total quantity per product, in id order so concurrent orders lock rows in the same order
+        quantities = {}
+        for order_product in order_products:
+            quantities[order_product["product_id"]] = quantities.get(order_product["product_id"], 0) + order_product["quantity"]
+        quantities = dict(sorted(quantities.items()))
+
+        # Load every product in the cart with one query, prices are computed from this result
+        products = {
+            product.id: product
+            for product in session.query(Product).filter(Product.id.in_(quantities.keys())).all()
+        }
+        if missing := [id for id in quantities if id not in products]:
+            raise Exception(f"Unknown products: {missing}")
+        blueprint["price"] = sum(quantity * products[id].price for id, quantity in quantities.items())
+
+        # Decrement all lines in one executemany. The stock check is part of the UPDATE, so two orders
+        # racing for the same product can't both pass it, and stock never goes negative.
+        stock = Product.__table__.c.stock
+        decrement = (
+            update(Product.__table__)
+            .where(Product.__table__.c.id == bindparam("product_id"), stock >= bindparam("quantity"))
+            .values(stock=stock - bindparam("quantity"))
+        )
+        result = session.execute(decrement, [
+            {"product_id": id, "quantity": quantity}
+            for id, quantity in quantities.items()
+        ])
+        if result.rowcount != len(quantities):
+            raise Exception("Not enough products in stock")
 
         order = Order(**blueprint)
-
-        order.order_products = [OrderProduct(order_id=order.id, **order_product) for order_product in order_products]
-
+        order.order_products = [OrderProduct(**order_product) for order_product in order_products]
         session.add(order)
-        session.merge(order)
-
-        price = 0.0
-        for orderproduct in order.order_products:
-            price += orderproduct.quantity * orderproduct.product.price
-
-            if orderproduct.product.stock >= orderproduct.quantity:
-                orderproduct.product.stock -= orderproduct.quantity
-            else:
-                raise Exception("Not enough products in stock")
-
-        order.price = price
+        session.flush() # Assigns the order id
+        rollups.record_order(session, order.timestamp, [ # Sales rollups, committed with the order
+            (id, products[id].manufacturer_id, quantity, products[id].price)
+            for id, quantity in quantities.items()
+        ])
 
         data = order.id
     except Exception as e:
@@ -360,6 +566,7 @@ def order():
     finally:
         session.commit() # Commit transaction to database
         session.close() # Close the session
+    table_versions.bump("order", "order_product", "product", snapshot.STOCK, "user", "product_sales", "daily_sales") # New order rows and stock changes
     return str(data), 200 # Return serialized item as a JSON response
 
 
@@ -379,19 +586,13 @@ def update_item(table_name, id):
     Returns:
         Response: JSON response containing the updated item ID.
     """
-    session = dbcontext.get_session() # Start a new database session
-    table = models.TABLES_GET(table_name).cls # Get the table class from on its name
+    session = dbcontext.get_request_session() # Get the request's database session
+    registry = models.TABLES_GET(table_name)
+    table = registry.cls # Get the table class from on its name
     try:
         blueprint = dict(request.json.items()) # Extract the update data from request body, and parse it into a dictionary
         if request.files:
-            img = request.files['image']
-            if img and validate_image_extention(img.filename):
-                name = str(uuid.uuid4()) + os.path.splitext(img.filename)[1]
-                path = os.path.join(app.config['IMAGE_FOLDER'], name)
-                img.save(path)
-                blueprint['image'] = f"static/images/{name}"
-            else:
-                raise Exception('invalid image')
+            blueprint['image'] = save_image(request.files['image'])
         obj = session.query(table).filter(table.id == id).first()
         for key, value in blueprint.items():
             setattr(obj, key, value)
@@ -401,6 +602,8 @@ def update_item(table_name, id):
     finally:
         session.commit() # Commit transaction to database
         session.close() # Close the session
+    table_versions.bump(*cache.related(registry)) # Invalidate cached reads of the changed tables
+    update_product_indexes(registry, [id])
     return jsonify(id), 200 # Return the ID of the updated item as a JSON response
 
 
@@ -418,8 +621,9 @@ def delete_item(table_name, id):
     Returns:
         Response: A success message.
     """
-    session = dbcontext.get_session() # Start a new database session
-    table = models.TABLES_GET(table_name).cls # Get the table class from on its name
+    session = dbcontext.get_request_session() # Get the request's database session
+    registry = models.TABLES_GET(table_name)
+    table = registry.cls # Get the table class from on its name
     try:
         data = session.query(table).filter(table.id == id).first() # Query the table for the specific item by its ID
         session.delete(data) # Delete the item from the session
@@ -430,19 +634,158 @@ def delete_item(table_name, id):
         session.commit() # Commit transaction to database
         session.close() # Close the session
 
+    table_versions.bump(*cache.related(registry)) # Invalidate cached reads of the changed tables, cascades included
+    update_product_indexes(registry, [id])
     return "deleted",  200 # Return a success message
 
 
+def run_bulk(table_name, operation, result_name):
+    """
+    Runs a bulk operation from bulk.py on the records in the request body, in one transaction.
+
+    Args:
+        table_name (str): The name of the database table.
+        operation (function): bulk_create, bulk_update or bulk_delete.
+        result_name (str): Key of the affected row count in the response.
+
+    Returns:
+        Response: {result_name: count}, or {"errors": [{"index": i, "error": "..."}]} if records are invalid.
+    """
+    session = dbcontext.get_request_session() # Get the request's database session
+    registry = models.TABLES_GET(table_name) # Get the table from its name
+    try:
+        if registry is None:
+            raise Exception(f"Unknown table: {table_name}")
+        records = request.json
+        count = operation(session, registry, records)
+        session.commit() # Commit here, so database errors roll back every row
+    except bulk.BulkError as e:
+        session.rollback()
+        return jsonify({"errors": e.errors}), 400 # Per record validation errors, nothing is written
+    except Exception as e:
+        session.rollback() # Roll back changes if an error occurs
+        return str(e), 400 # Return error message with 400 status code
+    finally:
+        session.close() # Close the session
+    table_versions.bump(*cache.related(registry)) # Invalidate cached reads of the changed tables
+    if operation is bulk.bulk_create:
+        invalidate_product_indexes(registry) # New ids aren't known, rebuild on the next query
+    else:
+        update_product_indexes(registry, [record["id"] if isinstance(record, dict) else record for record in records])
+    return jsonify({result_name: count}), 200
+
+
+""" JSON bulk exempel:
+POST   /api/bulk/create/product   [{"name": "Ny", "image": "static/images/default.jpg", "price": 10, "manufacturer_id": 1, "details_id": 1}]
+PUT    /api/bulk/update/product   [{"id": 1, "price": 42}, {"id": 2, "stock": 0}]
+DELETE /api/bulk/delete/product   [1, 2, 3]
+"""
+
+@app.route('/api/bulk/create/<string:table_name>', methods=['POST'], endpoint='bulk_create_entries')
+@jwt_required()
+@admin_required
+def bulk_create_items(table_name):
+    """
+    Inserts a list of records into a table.
+    """
+    return run_bulk(table_name, bulk.bulk_create, "created")
+
+
+@app.route('/api/bulk/update/<string:table_name>', methods=['PUT'], endpoint='bulk_update_entries')
+@jwt_required()
+@admin_required
+def bulk_update_items(table_name):
+    """
+    Updates a list of records by their id, each record only needs the columns that change.
+    """
+    return run_bulk(table_name, bulk.bulk_update, "updated")
+
+
+@app.route('/api/bulk/delete/<string:table_name>', methods=['DELETE'], endpoint='bulk_delete_entries')
+@jwt_required()
+@admin_required
+def bulk_delete_items(table_name):
+    """
+    Deletes a list of ids from a table, with the same cascades as delete_item.
+    """
+    return run_bulk(table_name, bulk.bulk_delete, "deleted")
+
+
+@app.route('/api/search', methods=['GET'], endpoint='search_products')
+def search_products():
+    """
+    Searches products by product and manufacturer name, tolerating typos, e.g. /api/search?q=chee&limit=10.
+
+    Returns:
+        Response: Product summaries with a score, best match first.
+    """
+    session = dbcontext.get_request_session()
+    try:
+        query = request.args.get('q', '')
+        limit = min(int(request.args.get('limit', 10)), 100)
+        data = current_index(search_index, session).search(query, limit)
+    except Exception as e:
+        return str(e), 400 # Return error message with 400 status code
+    finally:
+        session.close() # Close the session
+    return jsonify(data), 200
+
+
+@app.route('/api/recommendations/<int:id>', methods=['GET'], endpoint='recommendations')
+def recommendations(id):
+    """
+    Products with the most similar nutrition to a product, e.g. /api/recommendations/12?k=5.
+
+    Returns:
+        Response: Product summaries with their distance, most similar first.
+    """
+    session = dbcontext.get_request_session()
+    try:
+        k = int(request.args.get('k', 5))
+        data = current_index(similarity_index, session).similar(id, k)
+        if data is None:
+            return "Product not found", 404
+    except Exception as e:
+        return str(e), 400 # Return error message with 400 status code
+    finally:
+        session.close() # Close the session
+    return jsonify(data), 200
+
+
+@app.route('/api/catalog', methods=['POST'], endpoint='catalog')
+def catalog():
+    """
+    Filters products by product and nutrition columns on the in-memory catalog snapshot, without querying the database.
+    The body uses the same filters as get_items, e.g. {"sugars": ["<", 5], "fiber": ["range", [3, 10]], "is_hot": false}.
+    With "facets": ["manufacturer_id", "is_hot"], the matches are also counted per value of those columns.
+
+    Returns:
+        Response: Products with details and manufacturer, or {"items": [...], "facets": {...}} if facets were requested.
+    """
+    session = dbcontext.get_request_session()
+    try:
+        filters = dict(request.json.items()) if request.data else {}
+        facets = filters.pop("facets", None)
+        items, counts = catalog_snapshot.query(session, filters, facets)
+        data = items if counts is None else {"items": items, "facets": counts}
+    except Exception as e:
+        return str(e), 400 # Return error message with 400 status code
+    finally:
+        session.close() # Close the session
+    return jsonify(data), 200
+
+
 @app.route('/api/user', methods=['POST'])
 def create_user():
-    session = dbcontext.get_session()
+    session = dbcontext.get_request_session()
     try:
         blueprint = dict(request.json.items())
-        blueprint['password'] = bcrypt.generate_password_hash(blueprint['password']).decode('utf-8')
 
         if session.query(models.User).filter(models.User.email == blueprint["email"]).first():
             raise Exception("An account with this e-mail already exists")
 
+        blueprint['password'] = password_hasher.hash(blueprint['password'])
+
         user = models.User(**blueprint)
 
         session.add(user)
@@ -452,6 +795,9 @@ def create_user():
     except (IntegrityError, pymysql_IntegrityError) as e:
         session.rollback() # Roll back changes if an error occurs
         return "Database error", 400
+    except hashing.HasherBusy as e:
+        session.rollback()
+        return str(e), 503, {"Retry-After": "1"} # Hashing queue is full, or a worker died or timed out
     except Exception as e:
         session.rollback() # Roll back changes if an error occurs
         return str(e), 400 # Return error message with 400 status code
@@ -459,6 +805,7 @@ def create_user():
         session.commit() # Commit transaction to database
         session.close() # Close the session
 
+    table_versions.bump("user") # The user's token changed
     response = Response("OK")
     set_access_cookies(response, access_token)
 
@@ -467,16 +814,21 @@ def create_user():
 
 @app.route('/api/login', methods=['POST'])
 def login():
-    session = dbcontext.get_session()
+    session = dbcontext.get_request_session()
     try:
         blueprint = dict(request.json.items())
         user = session.query(models.User).filter(models.User.email == blueprint['email']).first()
-        if not user or not bcrypt.check_password_hash(user.password, blueprint['password']):
+        if not user or not password_hasher.check(user.password, blueprint['password']):
             raise Exception("invalid login")
+        if password_hasher.needs_rehash(user.password): # Work factor changed since the hash was made
+            user.password = password_hasher.hash(blueprint['password'])
 
         access_token = create_access_token(identity={'id': user.id, 'email': user.email})
         user.token = access_token
 
+    except hashing.HasherBusy as e:
+        session.rollback()
+        return str(e), 503, {"Retry-After": "1"} # Hashing queue is full, or a worker died or timed out
     except Exception as e:
         session.rollback() # Roll back changes if an error occurs
         return str(e), 400 # Return error message with 400 status code
@@ -484,6 +836,7 @@ def login():
         session.commit() # Commit transaction to database
         session.close() # Close the session
 
+    table_versions.bump("user") # The user's token changed
     response = Response("OK")
     set_access_cookies(response, access_token)
 
@@ -494,7 +847,7 @@ def login():
 @jwt_required()
 @user_required
 def logout():
-    session = dbcontext.get_session()
+    session = dbcontext.get_request_session()
     try:
         id = get_jwt_identity().get('id')
         user = session.query(models.User).filter(models.User.id == id).first()
@@ -509,6 +862,7 @@ def logout():
     finally:
         session.commit() # Commit transaction to database
         session.close() # Close the session
+    table_versions.bump("user") # The user's token changed
     return response, 200
 
 
@@ -516,7 +870,7 @@ def logout():
 @jwt_required()
 @user_required
 def set_user_information():
-    session = dbcontext.get_session()
+    session = dbcontext.get_request_session()
     try:
         blueprint = dict(request.json.items())
         id = get_jwt_identity().get('id')
@@ -530,23 +884,58 @@ def set_user_information():
     finally:
         session.commit() # Commit transaction to database
         session.close() # Close the session
+    table_versions.bump("user")
     return "OK", 200 # Return a success message
 
 
+HISTORY_LIMIT = 20  # orders per page of the order history
+PRODUCT_SUMMARY = ("id", "name", "image", "price")  # product fields embedded in the order history
+
 @app.route('/api/user/info', methods=['GET'], endpoint='get_user_information')
 @jwt_required()
 @user_required
 def get_user_information():
-    session = dbcontext.get_session()
+    """
+    Returns the logged in user's information with a page of their order history, newest first.
+    The history is read with a fixed number of queries however many orders the user has:
+    the orders page, its order lines, and with products=1 the ordered products.
+
+    Query string:
+        limit:      orders per page (default HISTORY_LIMIT)
+        cursor:     next_cursor of the previous page
+        products:   1 to embed a summary of each ordered product (id, name, image, price)
+
+    Returns:
+        Response: The user's information, "orders" and "next_cursor" (null on the last page).
+    """
+    session = dbcontext.get_request_session()
     try:
         id = get_jwt_identity().get('id')
+        products = request.args.get('products') == '1'
         user = session.query(models.User).filter(models.User.id == id).first()
-        mappers = ['orders', 'orders.order_products']
 
-        data = serialize_model(user, mappers)
+        page = pagination.Page.from_request(models.TABLES_GET('order'), {
+            "limit": request.args.get('limit', HISTORY_LIMIT),
+            "order_by": "-timestamp",
+            "cursor": request.args.get('cursor'),
+        })
+        mappers = ['order_products'] + (['order_products.product'] if products else [])
+        query = session.query(models.Order).options(*loaders.loader_plan(models.Order, mappers)).filter(models.Order.user_id == id)
+        start = time.perf_counter()
+        orders, next_cursor = page.result(page.apply(query).all()) # order lines and products are selectin loaded
+        query_usage.record("order", [("user_id", "==", id), ("timestamp", "order_by", None)], time.perf_counter() - start)
+        query_usage.record("order_product", [("order_id", "in", [order.id for order in orders])])
+
+        data = serialize_model(user)
         data.pop("password")
         data.pop("token")
         data.pop("id")
+        data["orders"] = serializers.serialize_all(orders, mappers)
+        if products:
+            for order in data["orders"]:
+                for order_product in order["order_products"]:
+                    order_product["product"] = {key: order_product["product"][key] for key in PRODUCT_SUMMARY}
+        data["next_cursor"] = next_cursor
     except Exception as e:
         session.rollback() # Roll back changes if an error occurs
         return str(e), 400 # Return error message with 400 status code
@@ -556,7 +945,167 @@ def get_user_information():
     return jsonify(data), 200 # Return a success message
 
 
+@app.route('/api/cache/stats', methods=['GET'], endpoint='cache_stats')
+@jwt_required()
+@admin_required
+def cache_stats():
+    """
+    Reports hits, misses, evictions and size of the read result cache, and of the compressed response cache.
+    """
+    return jsonify({**result_cache.stats(), "compressed": response_compressor.stats()}), 200
+
+
+@app.route('/api/db/pool', methods=['GET'], endpoint='pool_status')
+@jwt_required()
+@admin_required
+def pool_status():
+    """
+    Reports connection pool usage: checked out and overflow connections, checkouts and time spent waiting.
+    """
+    return jsonify(dbcontext.pool_status()), 200
+
+
+@app.route('/api/hashing/stats', methods=['GET'], endpoint='hashing_stats')
+@jwt_required()
+@admin_required
+def hashing_stats():
+    """
+    Reports password hashing and verification latency, and requests rejected because the queue was full.
+    """
+    return jsonify(password_hasher.stats()), 200
+
+
+@app.route('/api/query/stats', methods=['GET'], endpoint='query_stats')
+@jwt_required()
+@admin_required
+def query_statistics():
+    """
+    Reports the filtered and sorted columns per query shape with frequency and latency,
+    and the indexes index_advisor.py would add for them. Save the response for index_advisor.py --stats.
+    """
+    shapes = query_usage.report()
+    return jsonify({
+        "shapes": shapes,
+        "columns": query_usage.columns(),
+        "suggestions": index_advisor.suggest(shapes),
+    }), 200
+
+
+def run_analytics(report, **arguments):
+    """
+    Answers an analytics endpoint from the sales rollups, see rollups.py.
+
+    Args:
+        report (function): top_sellers, revenue_by_manufacturer or burn_rate.
+        arguments: Query string parameter name -> type, passed on when present.
+    """
+    session = dbcontext.get_request_session()
+    try:
+        parameters = {
+            name: kind(request.args[name])
+            for name, kind in arguments.items()
+            if name in request.args
+        }
+        data = report(session, **parameters)
+    except Exception as e:
+        return str(e), 400 # Return error message with 400 status code
+    finally:
+        session.close() # Close the session
+    return jsonify(data), 200
+
+
+@app.route('/api/analytics/top-sellers', methods=['GET'], endpoint='top_sellers')
+@jwt_required()
+@admin_required
+def top_sellers():
+    """
+    Products with the most units sold. ?limit=10, ?days=N for the last N days instead of all time.
+    """
+    return run_analytics(rollups.top_sellers, limit=int, days=int)
+
+
+@app.route('/api/analytics/revenue', methods=['GET'], endpoint='revenue_by_manufacturer')
+@jwt_required()
+@admin_required
+def revenue_by_manufacturer():
+    """
+    Revenue per manufacturer over the last ?days=30, per ?bucket=day, week or month.
+    """
+    return run_analytics(rollups.revenue_by_manufacturer, days=int, bucket=str)
+
+
+@app.route('/api/analytics/burn-rate', methods=['GET'], endpoint='burn_rate')
+@jwt_required()
+@admin_required
+def burn_rate():
+    """
+    Units sold per day over the last ?days=30 and the days of stock left, products running out first. ?limit=20
+    """
+    return run_analytics(rollups.burn_rate, days=int, limit=int)
+
+
+@app.route('/metrics', methods=['GET'], endpoint='prometheus_metrics')
+def prometheus_metrics():
+    """
+    Request, SQL, serialization and bcrypt metrics of every worker, in the Prometheus text format.
+    """
+    pool = dbcontext.pool_status()
+    lines = [
+        "# HELP db_pool_checked_out Connections in use in this process.",
+        "# TYPE db_pool_checked_out gauge",
+        f"db_pool_checked_out {pool['checked_out'] or 0}",
+        "# HELP db_pool_wait_seconds_total Time this process waited for a pooled connection.",
+        "# TYPE db_pool_wait_seconds_total counter",
+        f"db_pool_wait_seconds_total {pool['wait_total']}",
+    ]
+    body = metrics.registry.render(os.environ.get('METRICS_DIR')) + "\n".join(lines) + "\n"
+    return Response(body, 200, mimetype="text/plain; version=0.0.4")
+
+
+@app.route('/api/images/gc', methods=['POST'], endpoint='collect_image_garbage')
+@jwt_required()
+@admin_required
+def collect_image_garbage():
+    """
+    Removes uploaded images no product refers to.
+    With {"dry_run": true} in the body, only lists the images that would be removed.
+    """
+    session = dbcontext.get_request_session()
+    try:
+        dry_run = bool(request.data and request.json.get("dry_run"))
+        removed = images.collect_garbage(session, app.config['IMAGE_FOLDER'], dry_run)
+    except Exception as e:
+        return str(e), 400 # Return error message with 400 status code
+    finally:
+        session.close() # Close the session
+    return jsonify({"removed": removed, "dry_run": dry_run}), 200
+
+
+metrics_dumping = None  # set in workers sharing their metrics through METRICS_DIR
+
+def after_fork():
+    """
+    Prepares a forked worker process, see serve.py: the worker gets its own database connections and bcrypt pool,
+    and shares its metrics with the other workers.
+    """
+    global password_hasher, metrics_dumping
+    dbcontext.after_fork()
+    password_hasher = hashing.PasswordHasher()
+    if folder := os.environ.get('METRICS_DIR'):
+        metrics_dumping = metrics.start_dumping(folder)
+
+def shutdown():
+    """
+    Releases the process's bcrypt pool, resize threads and database connections.
+    """
+    password_hasher.shutdown()
+    thumbnail_cache.shutdown()
+    dbcontext.close()
+    if metrics_dumping is not None:
+        metrics_dumping.set()
+        metrics.registry.dump(os.environ['METRICS_DIR']) # Count the last requests
+
 
 if __name__ == "__main__":
-    populateDB()    # populate db with example data
+    init_database()    # keep, seed or reset the database, see DB_STARTUP
     app.run()   # start flask app
@@ -0,0 +1,31 @@
+"""
+The benchmarks' own SQLite database, so they never touch the database configured in dbinfo.py.
+
+Environment:
+    BENCH_DATABASE:  path of the SQLite file (default cereal-benchmark.db in the temp folder)
+"""
+import os
+import sys
+import tempfile
+import types
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+
+
+def path() -> str:
+    return os.environ.get("BENCH_DATABASE", os.path.join(tempfile.gettempdir(), "cereal-benchmark.db"))
+
+
+def install():
+    """
+    Stands in for dbinfo.py, call before anything imports dbcontext, which connects on import.
+    """
+    sys.modules["dbinfo"] = types.SimpleNamespace(connection_string=f"sqlite:///{path()}")
+
+
+def server_command(workers: int, threads: int, port: int) -> list:
+    """
+    Command running serve.py on the benchmark database, to start from the Backend folder.
+    """
+    code = f"import sys; sys.path.insert(0, {BENCHMARKS!r}); import benchdb; benchdb.install(); import serve; serve.main()"
+    return [sys.executable, "-c", code, "--workers", str(workers), "--threads", str(threads), "--port", str(port)]
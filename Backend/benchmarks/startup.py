@@ -0,0 +1,91 @@
+"""
+Startup benchmark: compares seeding through ORM add_all (with bcrypt hashing of the admin password),
+the bulk Core seeding in db_seed.seed, and starting on an existing schema (DB_STARTUP=keep).
+Runs against temporary SQLite files, from the Backend folder:
+
+    python benchmarks/startup.py --repeat 5
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bcrypt
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+import db_seed
+from models import Base, Manufacturer, Product, ProductDetails, User
+
+
+def orm_seed(session: Session):
+    """
+    The previous seeding: one ORM object per row, flushed through the unit of work.
+    """
+    manufacturers, details, products = db_seed.create_manufacturers_and_products()
+    session.add_all(User(**customer) for customer in db_seed.create_customers()[:-1])
+    mfrs = {row["id"]: Manufacturer(name=row["name"]) for row in manufacturers.to_dicts()}
+    details = {row.pop("id"): ProductDetails(**row) for row in details.to_dicts()}
+    for row in products.to_dicts():
+        row.pop("id")
+        session.add(Product(
+            manufacturer=mfrs[row.pop("manufacturer_id")],
+            details=details[row.pop("details_id")],
+            **row,
+        ))
+    session.add(User(email="a@a", name="Bobby", address="Abevej 123", admin=True,
+                     password=bcrypt.hashpw(b"123", bcrypt.gensalt(12)).decode()))
+
+
+def timed(function) -> float:
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def run(seeder, existing: bool) -> float:
+    """
+    Times one startup against a fresh SQLite file: reset and seed, or keep an already seeded database.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        engine = create_engine(f"sqlite:///{os.path.join(folder, 'bench.db')}")
+        if existing:
+            Base.metadata.create_all(engine)
+            with Session(engine) as session:
+                db_seed.seed(session)
+                session.commit()
+
+        def startup():
+            if existing:
+                Base.metadata.create_all(engine)  # keep: only creates missing tables
+                return
+            Base.metadata.drop_all(engine)
+            Base.metadata.create_all(engine)
+            with Session(engine) as session:
+                seeder(session)
+                session.commit()
+
+        elapsed = timed(startup)
+        engine.dispose()
+        return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    cases = {
+        "reset + ORM seed": (orm_seed, False),
+        "reset + bulk seed": (db_seed.seed, False),
+        "keep": (None, True),
+    }
+    for name, (seeder, existing) in cases.items():
+        times = sorted(run(seeder, existing) for _ in range(args.repeat))
+        print(f"{name:20} best {times[0] * 1000:8.1f} ms   median {times[len(times) // 2] * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+"""
+Benchmark suite: generates a scaled up dataset, times the hot helpers in process (micro) and drives concurrent
+requests against serve.py (load), reporting p50/p95/p99 latency, throughput and SQL queries per request.
+Results can be saved as a baseline and later runs compared against it. From the Backend folder:
+
+    python benchmarks/suite.py --save benchmarks/baseline.json      # record a baseline
+    python benchmarks/suite.py --compare benchmarks/baseline.json   # exits with 1 on regressions
+    python benchmarks/suite.py micro --skip-generate --repeat 9
+
+Runs against the SQLite file of benchdb.py (BENCH_DATABASE), whose data is REPLACED by the generated dataset
+(datagen.py) unless --skip-generate is given. Numbers are only comparable between runs on the same machine
+with the same options, the options are stored with the results and compared too.
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import platform
+import random
+import re
+import signal
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.orm import joinedload
+import benchdb
+from throughput import BACKEND, free_port, wait_until_ready
+
+benchdb.install()  # never the database of dbinfo.py
+
+PERCENTILES = (50, 95, 99)
+SCENARIOS = ("catalog", "order", "login")
+ENDPOINTS = {"catalog": "get_items", "order": "order", "login": "login"}  # metrics endpoint label per scenario
+HIGHER_IS_BETTER = {"per_second"}
+CATALOG_FILTERS = 50  # distinct catalog queries the load driver picks from
+
+
+# dataset
+
+def generate(factor: int, users: int, orders: int, seed: int):
+    """
+    Replaces the database contents with datagen's scaled catalog, customers and orders, and rebuilds the rollups.
+    """
+    import datagen
+    import rollups
+    from dbcontext import DatabaseContext
+    dbcontext = DatabaseContext.get_instance()
+    dbcontext.clear_database()
+    with dbcontext.get_session() as session:
+        datagen.generate(session, factor=factor, users=users, orders=orders, seed=seed)
+        rollups.rebuild(session)
+        session.commit()
+
+
+def dataset_size() -> tuple:
+    """
+    Products and generated customers in the database, for --skip-generate runs on an earlier dataset.
+    """
+    import models
+    from dbcontext import DatabaseContext
+    with DatabaseContext.get_instance().get_session() as session:
+        products = session.query(models.Product).count()
+        users = session.query(models.User).filter(models.User.email.like("customer%@example.com")).count()
+    if not products or not users:
+        raise SystemExit("no generated data in the database, run without --skip-generate")
+    return products, users
+
+
+# micro benchmarks
+
+def per_call(function: Callable, number: int, repeat: int) -> float:
+    """
+    Median time of one call in microseconds, over repeat rounds of number calls.
+    """
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        rounds.append((time.perf_counter() - start) / number)
+    rounds.sort()
+    return rounds[len(rounds) // 2] * 1e6
+
+
+def micro(repeat: int) -> Dict[str, dict]:
+    """
+    Times serialize_model, filter_build, TABLES_GET and the bcrypt paths in this process.
+    """
+    import backend
+    import db_seed
+    import hashing
+    import models
+    import serializers
+
+    with backend.dbcontext.get_session() as session:
+        products = (
+            session.query(models.Product)
+            .options(joinedload(models.Product.manufacturer), joinedload(models.Product.details))
+            .order_by(models.Product.id).limit(100).all()
+        )
+        user = (
+            session.query(models.User)
+            .options(joinedload(models.User.orders).joinedload(models.Order.order_products))
+            .filter(models.User.email == "customer1@example.com").first()
+        )
+        product = products[0]
+        filters = {"price": ["range", [1, 50]], "stock": [">", 0], "manufacturer": ["in", [1, 2, 3]], "name": ["!=", ""]}
+        registry = models.TABLES_GET("product")
+
+        cases = {
+            "serialize_model product": (lambda: backend.serialize_model(product), 2000),
+            "serialize_model product+manufacturer+details": (lambda: backend.serialize_model(product, ["manufacturer", "details"]), 2000),
+            "serialize_model user+orders.order_products": (lambda: backend.serialize_model(user, ["orders", "orders.order_products"]), 200),
+            "serialize_all 100 products+manufacturer": (lambda: serializers.serialize_all(products, ["manufacturer"]), 50),
+            "filter_build 4 filters": (lambda: backend.filter_build(models.Product, filters.items()), 2000),
+            "TABLES_GET": (lambda: models.TABLES_GET("product"), 20000),
+            "TABLES_GET + get_column": (lambda: registry.get_column("manufacturer"), 20000),
+        }
+        results = {name: {"us": per_call(function, number, repeat)} for name, (function, number) in cases.items()}
+
+    rounds = int(os.environ.get("BCRYPT_ROUNDS", 12))
+    pw_hash = hashing._hash("123", rounds)
+    hasher = hashing.PasswordHasher(rounds=rounds, workers=1)
+    hasher.check(pw_hash, "123")  # start the pool process outside the timing
+    bcrypt_cases = {
+        f"bcrypt hash ({rounds} rounds)": lambda: hashing._hash("123", rounds),
+        f"bcrypt check ({rounds} rounds)": lambda: hashing._check(pw_hash, "123"),
+        f"bcrypt check via PasswordHasher ({rounds} rounds)": lambda: hasher.check(pw_hash, "123"),
+        "bcrypt check seed hash": lambda: hashing._check(db_seed.ADMIN_PASSWORD_HASH, "123"),
+    }
+    for name, function in bcrypt_cases.items():
+        results[name] = {"us": per_call(function, 1, min(repeat, 3))}
+    hasher.shutdown()
+    backend.dbcontext.close()  # the load test's server opens the file next
+    return results
+
+
+# load driver
+
+def catalog_request(rng: random.Random, products: int, users: int) -> tuple:
+    low = rng.randrange(CATALOG_FILTERS)
+    body = {"mappers": ["manufacturer"], "price": ["range", [low, low + 5]], "stock": [">", 0]}
+    return "/api/get/product", body
+
+
+def order_request(rng: random.Random, products: int, users: int) -> tuple:
+    index = rng.randint(1, users)
+    body = {
+        "email": f"customer{index}@example.com",
+        "name": f"Customer {index}",
+        "address": f"Testvej {index}, 9999 by, land",
+        "order_products": [{"product_id": rng.randint(1, products), "quantity": 1} for _ in range(rng.randint(1, 3))],
+    }
+    return "/api/order", body
+
+
+def login_request(rng: random.Random, products: int, users: int) -> tuple:
+    return "/api/login", {"email": f"customer{rng.randint(1, users)}@example.com", "password": "123"}
+
+
+REQUESTS = {"catalog": catalog_request, "order": order_request, "login": login_request}
+
+
+def client(port: int, scenario: str, size: tuple, duration: float, seed: int, results):
+    """
+    Sends requests of a scenario one after another until duration has passed, timing each.
+    Puts (latencies of successful requests in seconds, failed requests) on results.
+    """
+    rng = random.Random(seed)
+    latencies, errors = [], 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        path, body = REQUESTS[scenario](rng, *size)
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        start = time.perf_counter()
+        try:
+            connection.request("POST", path, json.dumps(body), {"Content-Type": "application/json"})
+            response = connection.getresponse()
+            response.read()
+            if response.status == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+        except OSError:
+            errors += 1
+        finally:
+            connection.close()
+    results.put((latencies, errors))
+
+
+def scrape(port: int) -> Dict[str, Dict[str, float]]:
+    """
+    Sum and count of db_queries_per_request per endpoint, from /metrics.
+    """
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    connection.request("GET", "/metrics")
+    text = connection.getresponse().read().decode()
+    connection.close()
+    totals: Dict[str, Dict[str, float]] = {}
+    for kind, endpoint, value in re.findall(r'^db_queries_per_request_(sum|count)\{endpoint="([^"]*)"\} (\S+)$', text, re.M):
+        totals.setdefault(endpoint, {})[kind] = float(value)
+    return totals
+
+
+def percentile(ordered: List[float], p: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def load(scenarios: List[str], size: tuple, clients: int, duration: float, workers: int, threads: int) -> Dict[str, dict]:
+    """
+    Starts serve.py on the generated database and runs each scenario with clients concurrent client processes.
+    size is (products, generated customers), the ids and emails the requests pick from.
+    """
+    import metrics
+    port = free_port()
+    server = subprocess.Popen(
+        benchdb.server_command(workers, threads, port),
+        cwd=BACKEND, env={**os.environ, "DB_STARTUP": "keep"}, stderr=subprocess.DEVNULL,
+    )
+    results = {}
+    try:
+        wait_until_ready(port)
+        for scenario in scenarios:
+            client(port, scenario, size, 1.0, -1, multiprocessing.Queue())  # warm up caches and connections
+            time.sleep(metrics.DUMP_INTERVAL + 1)  # every worker's counts reach /metrics
+            before = scrape(port)
+
+            queue = multiprocessing.Queue()
+            processes = [
+                multiprocessing.Process(target=client, args=(port, scenario, size, duration, seed, queue))
+                for seed in range(clients)
+            ]
+            start = time.perf_counter()
+            for process in processes:
+                process.start()
+            counts = [queue.get() for _ in processes]
+            elapsed = time.perf_counter() - start
+            for process in processes:
+                process.join()
+
+            time.sleep(metrics.DUMP_INTERVAL + 1)
+            after = scrape(port)
+            endpoint = ENDPOINTS[scenario]
+            queries = after.get(endpoint, {}).get("sum", 0) - before.get(endpoint, {}).get("sum", 0)
+            requests = after.get(endpoint, {}).get("count", 0) - before.get(endpoint, {}).get("count", 0)
+
+            latencies = sorted(latency for batch, _ in counts for latency in batch)
+            results[scenario] = {
+                **{f"p{p}_ms": percentile(latencies, p) * 1000 for p in PERCENTILES},
+                "per_second": len(latencies) / elapsed,
+                "queries_per_request": queries / requests if requests else 0.0,
+                "requests": len(latencies),
+                "errors": sum(errors for _, errors in counts),
+            }
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+    return results
+
+
+# reporting
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    Prints every measurement next to the baseline, and returns the ones worse by more than tolerance (a fraction).
+    Request and error counts are shown but not judged.
+    """
+    if results["options"] != baseline.get("options"):
+        print(f"warning: options differ from the baseline's {baseline.get('options')}")
+    regressions = []
+    for section in ("micro", "load"):
+        for name, values in results.get(section, {}).items():
+            for key, value in values.items():
+                old = baseline.get(section, {}).get(name, {}).get(key)
+                if old is None:
+                    print(f"{section:5} {name:50} {key:20} {value:12.2f}   (not in baseline)")
+                    continue
+                change = (value - old) / old if old else 0.0
+                worse = -change if key in HIGHER_IS_BETTER else change
+                flag = ""
+                if key not in ("requests", "errors") and worse > tolerance:
+                    flag = "  REGRESSION"
+                    regressions.append(f"{section} {name} {key}")
+                print(f"{section:5} {name:50} {key:20} {value:12.2f} {old:12.2f} {change:+8.1%}{flag}")
+    return regressions
+
+
+def show(results: dict):
+    for section in ("micro", "load"):
+        for name, values in results.get(section, {}).items():
+            print(f"{section:5} {name:50} " + "  ".join(f"{key} {value:.2f}" for key, value in values.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("part", nargs="?", choices=("all", "micro", "load"), default="all")
+    parser.add_argument("--skip-generate", action="store_true", help="use the data already in the database")
+    parser.add_argument("--factor", type=int, default=10, help="copies of the cereal catalog")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--orders", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5, help="rounds per micro benchmark")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--clients", type=int, default=8, help="concurrent client processes")
+    parser.add_argument("--duration", type=float, default=10, help="[s] per scenario")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed slowdown before a regression is reported")
+    args = parser.parse_args()
+
+    if not args.skip_generate:
+        start = time.perf_counter()
+        generate(args.factor, args.users, args.orders, args.seed)
+        print(f"generated {args.factor}x catalog, {args.users} users, {args.orders} orders in {time.perf_counter() - start:.1f} s")
+
+    results = {
+        "options": {
+            "factor": args.factor, "users": args.users, "orders": args.orders, "clients": args.clients,
+            "duration": args.duration, "workers": args.workers, "threads": args.threads,
+        },
+        "machine": {"cpus": os.cpu_count(), "python": platform.python_version()},
+    }
+    if args.part in ("all", "micro"):
+        results["micro"] = micro(args.repeat)
+    if args.part in ("all", "load"):
+        results["load"] = load(args.scenarios, dataset_size(), args.clients, args.duration, args.workers, args.threads)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+    else:
+        show(results)
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
+    if regressions:
+        print(f"{len(regressions)} regressions beyond {args.tolerance:.0%}:\n  " + "\n  ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
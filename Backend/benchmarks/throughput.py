@@ -0,0 +1,116 @@
+"""
+Throughput benchmark: starts serve.py with an increasing number of workers and measures catalog reads per second
+(POST /api/get/product with the manufacturer mapper, as the storefront does), driven by client processes.
+Uses the benchmark database of benchdb.py, seeded if empty. From the Backend folder:
+
+    python benchmarks/throughput.py --workers 1 2 4 --clients 8 --duration 10
+
+Scaling is only near linear while there are idle cores for both the workers and the clients.
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import benchdb
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BODY = json.dumps({"mappers": ["manufacturer"]})
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def wait_until_ready(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"server on port {port} didn't start")
+
+
+def client(port: int, duration: float, results):
+    """
+    Sends catalog reads one after another until duration has passed, counting successful ones.
+    """
+    done = errors = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        try:
+            connection.request("POST", "/api/get/product", BODY, {"Content-Type": "application/json"})
+            response = connection.getresponse()
+            response.read()
+            if response.status == 200:
+                done += 1
+            else:
+                errors += 1
+        except OSError:
+            errors += 1
+        finally:
+            connection.close()
+    results.put((done, errors))
+
+
+def run(workers: int, threads: int, clients: int, duration: float) -> dict:
+    port = free_port()
+    server = subprocess.Popen(
+        benchdb.server_command(workers, threads, port),
+        cwd=BACKEND, env={**os.environ, "DB_STARTUP": "seed"}, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_ready(port)
+        client(port, 1.0, multiprocessing.Queue())  # warm up the workers' caches
+
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=client, args=(port, duration, results)) for _ in range(clients)]
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+        counts = [results.get() for _ in processes]
+        elapsed = time.perf_counter() - start
+        for process in processes:
+            process.join()
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+
+    done = sum(count for count, _ in counts)
+    return {
+        "workers": workers,
+        "requests": done,
+        "errors": sum(errors for _, errors in counts),
+        "per_second": done / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--clients", type=int, default=8, help="client processes sending requests")
+    parser.add_argument("--duration", type=float, default=10, help="[s] per worker count")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cores, {args.clients} clients, {args.threads} threads per worker")
+    baseline = None
+    for workers in args.workers:
+        result = run(workers, args.threads, args.clients, args.duration)
+        baseline = baseline or result["per_second"] / workers
+        print(f"{workers:3} workers {result['per_second']:9.1f} req/s   "
+              f"speedup {result['per_second'] / baseline:5.2f}x (ideal {workers}x)   {result['errors']} errors")
+
+
+if __name__ == "__main__":
+    main()
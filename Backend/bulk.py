@@ -0,0 +1,212 @@
+from datetime import datetime
+from typing import Dict, List, Tuple
+from sqlalchemy import bindparam, delete, insert, select, update
+from sqlalchemy.inspection import inspect as sa_inspect
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.interfaces import ONETOMANY
+import models
+
+BATCH_SIZE = 1000  # rows per executemany / IN list
+
+
+class BulkError(Exception):
+    """
+    Raised when records fail validation, holds one error per failing record.
+    """
+    def __init__(self, errors: List[dict]):
+        super().__init__(f"{len(errors)} invalid records")
+        self.errors = errors
+
+
+def batches(items: list, size: int = BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def validate_value(column: models.TableColumn, value):
+    """
+    Checks a value against a column's type, nullability and length, returning the value to store.
+    """
+    if value is None:
+        if not column.optional:
+            raise ValueError(f"{column.name} can't be null")
+        return None
+
+    if column.type is datetime:
+        if isinstance(value, str):
+            return datetime.fromisoformat(value)
+    elif column.type is float:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value)
+    elif column.type is int:
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+    elif column.type is str:
+        if isinstance(value, str):
+            length = getattr(column.inst.type, "length", None)
+            if length is not None and len(value) > length:
+                raise ValueError(f"{column.name} is longer than {length} characters")
+            return value
+    elif isinstance(value, column.type):
+        return value
+    raise ValueError(f"{column.name} must be {column.type.__name__}")
+
+
+def validate_record(table: models.Table, record, require_id: bool) -> dict:
+    """
+    Validates one record against the registry's column metadata.
+    Mapper names are accepted for their foreign key columns, e.g. "manufacturer" for "manufacturer_id".
+
+    Returns:
+        dict: The record keyed by column name, with converted values.
+    """
+    if not isinstance(record, dict):
+        raise ValueError("record must be an object")
+
+    row = {}
+    for key, value in record.items():
+        column = table.get_column(key)
+        if column is None:
+            raise ValueError(f"Unknown column: {key}")
+        row[column.name] = validate_value(column, value)
+
+    if require_id:
+        if not isinstance(row.get("id"), int):
+            raise ValueError("id is required")
+        if len(row) == 1:
+            raise ValueError("nothing to update")
+    else:
+        missing = [
+            column.name for column in table.columns
+            if column.name not in row
+            and not column.optional and not column.primary_key
+            and column.inst.default is None and column.inst.server_default is None
+        ]
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(missing)}")
+    return row
+
+
+def validate_records(table: models.Table, records, require_id: bool) -> List[dict]:
+    """
+    Validates every record, collecting all errors before raising so the client can fix them in one go.
+    """
+    if not isinstance(records, list) or not records:
+        raise BulkError([{"index": None, "error": "expected a non-empty list of records"}])
+
+    rows, errors = [], []
+    for index, record in enumerate(records):
+        try:
+            rows.append(validate_record(table, record, require_id))
+        except ValueError as e:
+            errors.append({"index": index, "error": str(e)})
+    if errors:
+        raise BulkError(errors)
+    return rows
+
+
+def group_by_keys(rows: List[dict]) -> Dict[Tuple[str, ...], List[dict]]:
+    """
+    Groups rows by the columns they set, since an executemany needs the same parameters in every row.
+    """
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+    return groups
+
+
+def bulk_create(session: Session, table: models.Table, records) -> int:
+    """
+    Inserts records with batched executemany INSERTs.
+
+    Returns:
+        int: Number of inserted rows.
+    """
+    rows = validate_records(table, records, require_id=False)
+    statement = insert(table.cls.__table__)
+    for group in group_by_keys(rows).values():
+        for batch in batches(group):
+            session.execute(statement, batch)
+    return len(rows)
+
+
+def bulk_update(session: Session, table: models.Table, records) -> int:
+    """
+    Updates records by id with batched executemany UPDATEs, without loading them first.
+    Ids without a row are reported like validation errors, before anything is written.
+
+    Returns:
+        int: Number of updated rows.
+    """
+    rows = validate_records(table, records, require_id=True)
+    columns = table.cls.__table__.c
+
+    ids = list({row["id"] for row in rows})
+    existing = set()
+    for batch in batches(ids):
+        existing.update(session.execute(select(columns.id).where(columns.id.in_(batch))).scalars())
+    errors = [{"index": index, "error": f"No record with id {row['id']}"} for index, row in enumerate(rows) if row["id"] not in existing]
+    if errors:
+        raise BulkError(errors)
+
+    updated = 0
+    for keys, group in group_by_keys(rows).items():
+        statement = (
+            update(table.cls.__table__)
+            .where(columns.id == bindparam("_id"))
+            .values({key: bindparam(f"_{key}") for key in keys if key != "id"})
+        )
+        for batch in batches(group):
+            result = session.execute(statement, [{f"_{key}": value for key, value in row.items()} for row in batch])
+            updated += result.rowcount
+    return updated
+
+
+def cascade_delete(session: Session, table: models.Table, ids: List[int]) -> int:
+    """
+    Deletes rows by id, first deleting the rows of relationships with a delete cascade,
+    the same rows session.delete would remove through the ORM.
+
+    Returns:
+        int: Number of deleted rows in this table.
+    """
+    primary_key = table.cls.__table__.c.id
+    for name, relationship in sa_inspect(table.cls).relationships.items():
+        if relationship.cascade.delete and relationship.direction is ONETOMANY:
+            target = table.relationships[name]
+            (local, remote), = relationship.local_remote_pairs
+            parent_keys = ids if local is primary_key else select(local).where(primary_key.in_(ids))
+            # fetch the ids instead of using a subquery, MySQL can't delete from a table it selects from
+            child_ids = session.execute(select(target.cls.__table__.c.id).where(remote.in_(parent_keys))).scalars().all()
+            if child_ids:
+                cascade_delete(session, target, child_ids)
+
+    result = session.execute(delete(table.cls.__table__).where(primary_key.in_(ids)))
+    return result.rowcount
+
+
+def bulk_delete(session: Session, table: models.Table, ids) -> int:
+    """
+    Deletes rows by id in batches, cascading like the ORM does.
+
+    Args:
+        ids (list): Ids, or records with an id.
+
+    Returns:
+        int: Number of deleted rows.
+    """
+    if not isinstance(ids, list) or not ids:
+        raise BulkError([{"index": None, "error": "expected a non-empty list of ids"}])
+
+    values, errors = [], []
+    for index, id in enumerate(ids):
+        if isinstance(id, dict):
+            id = id.get("id")
+        if isinstance(id, int) and not isinstance(id, bool):
+            values.append(id)
+        else:
+            errors.append({"index": index, "error": "id must be an integer"})
+    if errors:
+        raise BulkError(errors)
+
+    return sum(cascade_delete(session, table, batch) for batch in batches(values))
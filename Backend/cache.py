@@ -0,0 +1,172 @@
+import ctypes
+import hashlib
+import multiprocessing
+import threading
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+from sqlalchemy.inspection import inspect as sa_inspect
+import models
+
+
+class TableVersions:
+    """
+    Per-table version counters. Writes bump the versions of the tables they change,
+    which invalidates every cached result read from those tables.
+    The counters live in shared memory, so worker processes forked after they were created (see serve.py)
+    see each other's writes. The table names are fixed when the counters are created.
+    """
+    def __init__(self, tables: Iterable[str]):
+        self._slots: Dict[str, int] = {table: slot for slot, table in enumerate(sorted(set(tables)))}
+        self._lock = multiprocessing.Lock()
+        self._versions = multiprocessing.RawArray(ctypes.c_longlong, len(self._slots))
+
+    def get(self, table: str) -> int:
+        slot = self._slots.get(table)
+        return self._versions[slot] if slot is not None else 0
+
+    def snapshot(self, tables: Iterable[str]) -> Tuple[Tuple[str, int], ...]:
+        return tuple((table, self.get(table)) for table in tables)
+
+    def bump(self, *tables: str) -> Dict[str, int]:
+        """
+        Returns:
+            Dict[str, int]: The new version of each table.
+        """
+        for table in tables:
+            if table not in self._slots:
+                raise KeyError(f"Unknown table version: {table}")
+        with self._lock:
+            for table in tables:
+                self._versions[self._slots[table]] += 1
+            return {table: self._versions[self._slots[table]] for table in tables}
+
+
+# changes on every start, so tags from before a restart (when versions start over) never match
+EPOCH = uuid.uuid4().hex
+
+
+def etag(key: Hashable, snapshot: Tuple) -> str:
+    """
+    Derives a strong ETag from a result cache key and the versions of the tables the result depends on.
+    The tag changes whenever one of the tables is written to, without reading or serializing the result.
+    """
+    return hashlib.sha1(repr((EPOCH, key, snapshot)).encode()).hexdigest()
+
+
+def dependencies(table: models.Table, mappers: Optional[List[str]] = None) -> Tuple[str, ...]:
+    """
+    Lists the tables a result depends on: the queried table and every table reached through the mappers.
+
+    Args:
+        table (Table): Registry entry of the queried table.
+        mappers (List[str]): Dotted mapper paths included in the result.
+
+    Returns:
+        Tuple[str]: Sorted table names.
+    """
+    tables = {table.table}
+    for mapper in mappers or []:
+        current = table
+        for name in mapper.split('.'):
+            current = current.relationships.get(name)
+            if current is None:
+                break
+            tables.add(current.table)
+    return tuple(sorted(tables))
+
+
+def related(table: models.Table) -> Tuple[str, ...]:
+    """
+    Lists the tables a write to a table can change: the table itself, the tables it has relationships with,
+    since foreign key changes show up in their mappers, and every table a delete cascades to, however deep
+    (user -> order -> order_product), the same walk as bulk.cascade_delete.
+    """
+    tables = {table.table, *(other.table for other in table.relationships.values())}
+    pending = [table]
+    cascaded = {table.table}
+    while pending:
+        current = pending.pop()
+        for name, relationship in sa_inspect(current.cls).relationships.items():
+            target = current.relationships[name]
+            if relationship.cascade.delete and target.table not in cascaded:
+                cascaded.add(target.table)
+                pending.append(target)
+    return tuple(sorted(tables | cascaded))
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0  # removed to stay within the byte budget
+    invalidations: int = 0  # removed because a table version changed
+    entries: int = 0
+    bytes: int = 0
+
+
+class ResultCache:
+    """
+    LRU cache of serialized responses, bounded by the total size of the cached bodies.
+    Each entry remembers the versions of the tables it was read from, and is dropped on lookup
+    if any of them has changed since.
+    """
+    def __init__(self, versions: TableVersions, max_bytes: int):
+        self.versions = versions
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, Tuple[Tuple, bytes]]" = OrderedDict()
+        self._stats = CacheStats()
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats.misses += 1
+                return None
+
+            snapshot, body = entry
+            if any(self.versions.get(table) != version for table, version in snapshot):
+                self._remove(key)
+                self._stats.invalidations += 1
+                self._stats.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._stats.hits += 1
+            return body
+
+    def put(self, key: Hashable, snapshot: Tuple, body: bytes):
+        """
+        Stores a response body.
+
+        Args:
+            key (Hashable): Cache key.
+            snapshot (Tuple): Table versions taken before the result was queried, see TableVersions.snapshot.
+            body (bytes): The serialized response.
+        """
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (snapshot, body)
+            self._stats.bytes += len(body)
+            while self._stats.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._stats.evictions += 1
+
+    def _remove(self, key: Hashable):
+        _, body = self._entries.pop(key)
+        self._stats.bytes -= len(body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._stats.bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._stats.entries = len(self._entries)
+            return asdict(self._stats)
@@ -0,0 +1,128 @@
+"""
+Negotiated compression of API responses: zstd, brotli and gzip.
+The encoding is picked from the request's Accept-Encoding, preferring zstd, then brotli, then gzip.
+
+Responses with a strong ETag (the cached reads, e.g. the catalog and single products) have their compressed
+bodies kept in memory per ETag and encoding. The ETag changes with the content, so a hot payload is
+compressed once per version instead of once per request.
+
+Environment:
+    COMPRESS_MIN_BYTES:                    bodies smaller than this are sent uncompressed (default 1024)
+    ZSTD_LEVEL, BROTLI_LEVEL, GZIP_LEVEL:  compression levels (default 3, 5, 6)
+    COMPRESSED_CACHE_BYTES:                memory for compressed bodies (default 16 MiB)
+"""
+import gzip
+import logging
+import os
+from typing import Dict, List, Optional
+from flask import Request, Response
+from cache import ResultCache, TableVersions
+
+try:
+    import zstandard
+except ImportError:  # pinned in requirements.txt, without it clients fall back to brotli or gzip
+    zstandard = None
+try:
+    import brotli
+except ImportError:  # pinned in requirements.txt, without it clients fall back to gzip
+    brotli = None
+
+log = logging.getLogger("compression")
+
+DEFAULT_LEVELS = {"zstd": 3, "br": 5, "gzip": 6}  # fast levels, per request compression is on the request thread
+LEVEL_VARIABLES = {"zstd": "ZSTD_LEVEL", "br": "BROTLI_LEVEL", "gzip": "GZIP_LEVEL"}
+COMPRESSIBLE = {"application/json", "application/javascript", "image/svg+xml"}  # and text/*
+
+
+def available() -> List[str]:
+    """
+    Supported encodings, most preferred first.
+    """
+    encodings = []
+    if zstandard is not None:
+        encodings.append("zstd")
+    if brotli is not None:
+        encodings.append("br")
+    encodings.append("gzip")
+    return encodings
+
+
+def compressible(mimetype: Optional[str]) -> bool:
+    return bool(mimetype) and (mimetype in COMPRESSIBLE or mimetype.startswith("text/"))
+
+
+class Compressor:
+    """
+    Compresses responses for the encodings clients accept, see Compressor.apply.
+    """
+    def __init__(self, min_bytes: int = None, levels: Dict[str, int] = None, cache_bytes: int = None):
+        self.min_bytes = min_bytes if min_bytes is not None else int(os.environ.get("COMPRESS_MIN_BYTES", 1024))
+        self.levels = {
+            encoding: int(os.environ.get(LEVEL_VARIABLES[encoding], level))
+            for encoding, level in DEFAULT_LEVELS.items()
+        }
+        self.levels.update(levels or {})
+        self.encodings = available()
+        if zstandard is None or brotli is None:
+            log.warning("zstandard or Brotli isn't installed, responses are only compressed with %s (pip install -r requirements.txt)",
+                        ", ".join(self.encodings))
+        if cache_bytes is None:
+            cache_bytes = int(os.environ.get("COMPRESSED_CACHE_BYTES", 16 * 1024 * 1024))
+        # keyed by (ETag, encoding), the ETag already carries the content version, so entries never go stale
+        self.cache = ResultCache(TableVersions([]), cache_bytes)
+
+    def compress(self, body: bytes, encoding: str) -> bytes:
+        level = self.levels[encoding]
+        if encoding == "zstd":
+            return zstandard.ZstdCompressor(level=level).compress(body)  # compressors aren't thread safe, one per call
+        if encoding == "br":
+            return brotli.compress(body, quality=level)
+        return gzip.compress(body, compresslevel=level, mtime=0)  # mtime=0: same input, same bytes
+
+    def apply(self, request: Request, response: Response) -> Response:
+        """
+        Compresses a response in place if the client accepts one of the encodings, and the body is compressible
+        and at least min_bytes. Streamed and file responses are left alone.
+
+        Args:
+            request (Request): The request, for Accept-Encoding.
+            response (Response): The finished response.
+
+        Returns:
+            Response: The same response.
+        """
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or "Content-Encoding" in response.headers or not compressible(response.mimetype)):
+            return response
+        body = response.get_data()
+        if len(body) < self.min_bytes:
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = request.accept_encodings.best_match(self.encodings)
+        if encoding is None:
+            return response
+
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            key = (etag, encoding)
+            compressed = self.cache.get(key)
+            if compressed is None:
+                compressed = self.compress(body, encoding)
+                self.cache.put(key, (), compressed)
+        else:
+            compressed = self.compress(body, encoding)
+
+        if len(compressed) < len(body):
+            response.set_data(compressed)
+            response.headers["Content-Encoding"] = encoding
+            if etag and not weak:
+                response.set_etag(etag, weak=True)  # other bytes than the uncompressed response with the same tag
+        return response
+
+    def stats(self) -> dict:
+        return {
+            "encodings": self.encodings,
+            "levels": {encoding: self.levels[encoding] for encoding in self.encodings},
+            "min_bytes": self.min_bytes,
+            **self.cache.stats(),
+        }
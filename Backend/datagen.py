@@ -0,0 +1,115 @@
+"""
+Scaled up test data for benchmarks: the cereal catalog repeated to any size, customers and order history.
+Generated from a seed, so every run produces the same rows.
+"""
+import random
+from datetime import datetime, timedelta
+from typing import List, Tuple
+import polars as pl
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+import db_seed
+from models import Manufacturer, Order, OrderProduct, Product, ProductDetails, User
+
+START = datetime(2024, 1, 1)  # orders are spread over the year after START
+DAYS = 365
+MAX_LINES = 4  # products per order
+
+
+def scale_catalog(factor: int, path: str = "cereal.csv") -> Tuple[pl.DataFrame, pl.DataFrame, pl.DataFrame]:
+    """
+    Repeats the cereal catalog factor times. Copies get a numbered name, their own details row,
+    and a varied price and stock, so filters on them are selective.
+
+    Returns:
+        Tuple[pl.DataFrame, pl.DataFrame, pl.DataFrame]: manufacturers, product details and products.
+    """
+    manufacturers, details, products = db_seed.create_manufacturers_and_products(path)
+    count = products.height
+    copies = pl.DataFrame({"copy": range(factor)}, schema={"copy": pl.Int64})
+
+    details = copies.join(details, how="cross").with_columns(
+        (pl.col("id") + pl.col("copy") * count).alias("id"),
+    ).drop("copy")
+
+    products = copies.join(products, how="cross").with_columns(
+        (pl.col("id") + pl.col("copy") * count).alias("id"),
+        (pl.col("details_id") + pl.col("copy") * count).alias("details_id"),
+        pl.when(pl.col("copy") == 0).then(pl.col("name")).otherwise(pl.col("name") + " #" + pl.col("copy").cast(pl.String)).alias("name"),
+        (pl.col("price") + pl.col("copy") % 50).alias("price"),
+        ((pl.col("id") * 7 + pl.col("copy") * 13) % 100).alias("stock"),
+    ).drop("copy")
+    return manufacturers, details, products
+
+
+def create_users(count: int) -> List[dict]:
+    """
+    Customers with the password '123', so load tests can log in as any of them.
+    """
+    return [
+        dict(
+            email=f"customer{index}@example.com",
+            name=f"Customer {index}",
+            address=f"Testvej {index}, 9999 by, land",
+            password=db_seed.ADMIN_PASSWORD_HASH,
+            admin=False,
+        )
+        for index in range(1, count + 1)
+    ]
+
+
+def create_orders(count: int, users: List[dict], products: pl.DataFrame, rng: random.Random) -> Tuple[List[dict], List[dict]]:
+    """
+    Builds orders with one to MAX_LINES products each, placed by random customers over DAYS days.
+
+    Returns:
+        Tuple[List[dict], List[dict]]: order rows and order_product rows, with explicit ids.
+    """
+    product_ids = products["id"].to_list()
+    prices = dict(zip(product_ids, products["price"].to_list()))
+    orders, lines = [], []
+    for id in range(1, count + 1):
+        user = rng.choice(users)
+        chosen = rng.sample(product_ids, rng.randint(1, min(MAX_LINES, len(product_ids))))
+        quantities = {product_id: rng.randint(1, 3) for product_id in chosen}
+        orders.append(dict(
+            id=id,
+            user_id=user["id"],
+            email=user["email"],
+            name=user["name"],
+            address=user["address"],
+            timestamp=START + timedelta(seconds=rng.randrange(DAYS * 24 * 60 * 60)),
+            price=sum(quantity * prices[product_id] for product_id, quantity in quantities.items()),
+            status="Ordered",
+        ))
+        lines.extend(
+            dict(id=len(lines) + 1, order_id=id, product_id=product_id, quantity=quantity)
+            for product_id, quantity in quantities.items()
+        )
+    return orders, lines
+
+
+def generate(session: Session, factor: int = 1, users: int = 100, orders: int = 1000, seed: int = 0):
+    """
+    Fills an empty database with the scaled catalog, the seed customers plus users generated customers,
+    and orders generated orders, with bulk Core inserts.
+
+    Args:
+        session (Session): Session on an empty database, committed by the caller.
+        factor (int): Copies of the cereal catalog.
+        users (int): Generated customers.
+        orders (int): Generated orders.
+        seed (int): Random seed.
+    """
+    rng = random.Random(seed)
+    manufacturers, details, products = scale_catalog(factor)
+    customers = [dict(id=id, **customer) for id, customer in enumerate(db_seed.create_customers() + create_users(users), start=1)]
+    session.execute(insert(User.__table__), customers)
+    session.execute(insert(Manufacturer.__table__), manufacturers.to_dicts())
+    session.execute(insert(ProductDetails.__table__), details.to_dicts())
+    session.execute(insert(Product.__table__), products.to_dicts())
+
+    if orders:
+        order_rows, line_rows = create_orders(orders, customers, products, rng)
+        session.execute(insert(Order.__table__), order_rows)
+        session.execute(insert(OrderProduct.__table__), line_rows)
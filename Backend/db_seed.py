@@ -1,79 +1,111 @@
 from models import Manufacturer, Product, ProductDetails, User
 
-import math
-import re
-import polars as pl
 import os
-from flask_bcrypt import Bcrypt
+import polars as pl
+from sqlalchemy import func, insert, select
+from sqlalchemy.orm import Session
+
+# bcrypt hash of the admin password '123', precomputed so seeding doesn't spend time hashing
+ADMIN_PASSWORD_HASH = "$2b$12$U.4a5tMEOzq3ybnWILmguOAUEBXkxcwz91XX9r7/sWHmT4XxGjoSG"
+
+MANUFACTURER_NAMES = {
+    "A": "American Home Food Products",
+    "G": "General Mills",
+    "K": "Kelloggs",
+    "N": "Nabisco",
+    "P": "Post",
+    "Q": "Quaker Oats",
+    "R": "Ralston Purina",
+}
+
+DETAIL_COLUMNS = ["weight", "cups", "calories", "protein", "fat", "sodium", "fiber", "carbohydrates", "sugars", "potassium", "vitamins"]
+
 
 def create_customers():
     return [
-        User(
+        dict(
             name="jens bo",
             password="password",
             email="jens@email.com",
             address="jensvej 41, 9999 by, land",
+            admin=False,
         ),
-        User(
+        dict(
             name="bob chris",
             password="123",
             email="ogbob@email.com",
             address="street 1, 9999 by, land",
+            admin=False,
         ),
-        User(
+        dict(
             name="Heihachi Mishima",
             password="eiuvnyq3oct9843mc 98ry32q04xt743q9y",
             email="Tekken@ironfist.com",
             address="Tekken tower, 9999 by, land",
             admin=True,
-        )
+        ),
+        dict(
+            email="a@a",
+            name="Bobby",
+            address="Abevej 123",
+            password=ADMIN_PASSWORD_HASH,
+            admin=True,
+        ),
     ]
 
 
-def create_manufacturers_and_products():
-    cereals = pl.read_csv("cereal.csv").to_dicts()
-
-    mfrs = {
-        "A": "American Home Food Products",
-        "G": "General Mills",
-        "K": "Kelloggs",
-        "N": "Nabisco",
-        "P": "Post",
-        "Q": "Quaker Oats",
-        "R": "Ralston Purina",
-    }
-
-    manufacturers: dict[str, Manufacturer] = {}
-    for cereal in cereals:
-        del cereal["shelf"]
-
-        cereal["price"] = math.ceil(cereal.pop("rating"))
-        cereal["stock"] = 10
-
-        cereal["name"] = cereal["name"].replace(";", ",")
-        # cereal["image"] = re.sub(r"[^a-zA-Z0-9\s\-\_\.]", "_", cereal["name"]) + '.jpg'
-        cereal["image"] = os.path.join('static', 'images', re.sub(r"[^a-zA-Z0-9\s\-\_\.]", "_", cereal["name"]) + '.jpg')
-
-        if cereal["mfr"] not in manufacturers:
-            manufacturers[cereal["mfr"]] = Manufacturer(name=mfrs[cereal["mfr"]])
-
-        cereal["manufacturer"] = manufacturers[cereal.pop("mfr")]
-
-        cereal["is_hot"] = cereal.pop("type") == "H"
-
-        cereal["carbohydrates"] = cereal.pop("carbo")
-        cereal["potassium"] = cereal.pop("potass")
-
-        cereal_keys = ["name", "image", "stock", "price", "manufacturer", "details"]
-        details = {}
-        for key in [key for key in cereal.keys() if key not in cereal_keys]:
-            details[key] = cereal.pop(key)
-
-        details = ProductDetails(**details)
-
-        cereal["details"] = details
-
-    products = [Product(**cereal) for cereal in cereals]
-
-    return list(manufacturers.values()), products
-
+def create_manufacturers_and_products(path="cereal.csv"):
+    """
+    Builds the manufacturer, product details and product rows from the cereal csv, with explicit ids
+    so they can be inserted in bulk without reading generated keys back.
+
+    Returns:
+        Tuple[pl.DataFrame, pl.DataFrame, pl.DataFrame]: manufacturers, product details and products.
+    """
+    cereals = pl.read_csv(path).with_row_index("id", offset=1).with_columns(
+        pl.col("name").str.replace_all(";", ",", literal=True),
+    )
+
+    # manufacturers get ids in the order they first appear
+    codes = cereals["mfr"].unique(maintain_order=True).to_list()
+    manufacturer_ids = {code: id for id, code in enumerate(codes, start=1)}
+    manufacturers = pl.DataFrame({
+        "id": list(manufacturer_ids.values()),
+        "name": [MANUFACTURER_NAMES[code] for code in codes],
+    })
+
+    details = cereals.select(
+        pl.col("id"),
+        (pl.col("type") == "H").alias("is_hot"),
+        pl.col("carbo").alias("carbohydrates"),
+        pl.col("potass").alias("potassium"),
+        pl.col("weight", "cups", "calories", "protein", "fat", "sodium", "fiber", "sugars", "vitamins"),
+    ).with_columns(pl.col(DETAIL_COLUMNS).cast(pl.Float64))
+
+    image_folder = os.path.join('static', 'images', '')
+    products = cereals.select(
+        pl.col("id"),
+        pl.col("name"),
+        (image_folder + pl.col("name").str.replace_all(r"[^a-zA-Z0-9\s_.-]", "_") + ".jpg").alias("image"),
+        pl.lit(10).alias("stock"),
+        pl.col("rating").ceil().alias("price"),
+        pl.col("mfr").replace_strict(manufacturer_ids, return_dtype=pl.Int64).alias("manufacturer_id"),
+        pl.col("id").alias("details_id"),
+    )
+
+    return manufacturers, details, products
+
+
+def seed(session: Session):
+    """
+    Inserts the example data with bulk Core inserts, straight from the polars frames.
+    """
+    manufacturers, details, products = create_manufacturers_and_products()
+    session.execute(insert(User.__table__), create_customers())
+    session.execute(insert(Manufacturer.__table__), manufacturers.to_dicts())
+    session.execute(insert(ProductDetails.__table__), details.to_dicts())
+    session.execute(insert(Product.__table__), products.to_dicts())
+
+
+def is_seeded(session: Session) -> bool:
+    return session.execute(select(func.count()).select_from(Product)).scalar() > 0
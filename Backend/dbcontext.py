@@ -1,8 +1,83 @@
+import os
+import threading
+import time
 from sqlalchemy.orm import Session
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import QueuePool
 from dbinfo import connection_string
+import metrics
 from models import *
+import rollups  # registers the sales rollup tables, so create_all creates them
+
+
+class PoolMetrics:
+    """
+    Counters for connection pool usage, updated by pool events and MeteredQueuePool.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connects = 0       # new database connections opened
+        self.checkouts = 0      # connections handed out by the pool
+        self.checkins = 0       # connections returned to the pool
+        self.timeouts = 0       # checkouts that gave up after pool_timeout
+        self.wait_total = 0.0   # [s] time spent waiting for a connection
+        self.wait_max = 0.0     # [s] longest wait for a connection
+
+    def record_wait(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+
+class MeteredQueuePool(QueuePool):
+    """
+    QueuePool that measures how long checkouts wait for a free connection.
+    """
+    metrics: PoolMetrics = None  # set by DatabaseContext
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except Exception:
+            self.metrics.record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        self.metrics.record_wait(time.perf_counter() - start)
+        return connection
+
+
+def pool_options(url: str) -> dict:
+    """
+    Reads the connection pool settings from the environment.
+    In-memory SQLite databases live in a single connection, so they keep SQLAlchemy's default pool.
+
+    Environment:
+        DB_POOL_SIZE:      connections kept open (default 5)
+        DB_MAX_OVERFLOW:   extra connections opened under load (default 10)
+        DB_POOL_TIMEOUT:   [s] wait for a connection before failing (default 30)
+        DB_POOL_RECYCLE:   [s] reopen connections older than this, -1 to disable (default 3600)
+        DB_POOL_PRE_PING:  test connections on checkout, 1 or 0 (default 1)
+    """
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}
+
+    return {
+        "poolclass": MeteredQueuePool,
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+        "pool_timeout": float(os.environ.get("DB_POOL_TIMEOUT", 30)),
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", 3600)),
+        "pool_pre_ping": os.environ.get("DB_POOL_PRE_PING", "1") == "1",
+    }
 
 
 class DatabaseContext:
@@ -21,10 +96,34 @@ class DatabaseContext:
         and ensuring all database tables are created.
         """
         if manualCall: raise Exception("YOU SHOULD NOT BE CALLING THIS CONSTRUCTOR >:(")
-        self.engine = create_engine(connection_string, echo=False)  # Create a database engine using the connection string, SQL query logging disabled
+        self.pool_metrics = PoolMetrics()
+        MeteredQueuePool.metrics = self.pool_metrics
+        self.engine = create_engine(connection_string, echo=False, **pool_options(connection_string))  # Create a database engine using the connection string, SQL query logging disabled
         self.Session = sessionmaker(bind=self.engine)               # Create a session factory bound to the engine
+        self.ScopedSession = scoped_session(self.Session)           # One session per thread, i.e. per request
+        self._listen_pool()
+        self._listen_queries()
         Base.metadata.create_all(self.engine)                       # Create all tables defined in the models module, if they don't already exist
 
+    def _listen_pool(self):
+        event.listen(self.engine, "connect", lambda *_: self.pool_metrics.count("connects"))
+        event.listen(self.engine, "checkout", lambda *_: self.pool_metrics.count("checkouts"))
+        event.listen(self.engine, "checkin", lambda *_: self.pool_metrics.count("checkins"))
+
+    def _listen_queries(self):
+        # time every statement for the request metrics, see metrics.py
+        event.listen(self.engine, "before_cursor_execute", self._before_query)
+        event.listen(self.engine, "after_cursor_execute", self._after_query)
+
+    @staticmethod
+    def _before_query(connection, cursor, statement, parameters, context, executemany):
+        connection.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @staticmethod
+    def _after_query(connection, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - connection.info["query_start"].pop()
+        metrics.record_query(statement, elapsed, cursor.rowcount)
+
     def get_session(self) -> Session:
         """
         Start a new database session.
@@ -34,6 +133,53 @@ class DatabaseContext:
         """
         return self.Session()
 
+    def get_request_session(self) -> Session:
+        """
+        Get the session of the current request, creating it on first use.
+        Decorators and views calling this in the same request share one session and connection.
+
+        Returns:
+            Session: The request's SQLAlchemy session.
+        """
+        return self.ScopedSession()
+
+    def remove_request_session(self):
+        """
+        Close the current request's session and return its connection to the pool.
+        Called when the request ends.
+        """
+        self.ScopedSession.remove()
+
+    def after_fork(self):
+        """
+        Drops the pooled connections inherited from the parent process, without closing them, since the parent
+        still owns them. Call in a forked worker before it uses the database, the pool then opens its own connections.
+        """
+        self.ScopedSession.remove()
+        self.engine.dispose(close=False)
+
+    def pool_status(self) -> dict:
+        """
+        Live pool usage and the counters collected since startup.
+
+        Returns:
+            dict: Pool size, checked out and overflow connections, and PoolMetrics counters.
+        """
+        pool = self.engine.pool
+        metrics = self.pool_metrics
+        return {
+            "pool": type(pool).__name__,
+            "size": pool.size() if hasattr(pool, "size") else None,
+            "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else None,
+            "overflow": pool.overflow() if hasattr(pool, "overflow") else None,
+            "connects": metrics.connects,
+            "checkouts": metrics.checkouts,
+            "checkins": metrics.checkins,
+            "timeouts": metrics.timeouts,
+            "wait_total": metrics.wait_total,
+            "wait_max": metrics.wait_max,
+        }
+
     def clear_database(self):
         """
         Drops all tables in the database and recreates them.
@@ -0,0 +1,160 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+import bcrypt
+import metrics
+
+
+class HasherBusy(Exception):
+    """
+    Raised when the hashing queue is full, the request should be retried later.
+    """
+    pass
+
+
+class HasherUnavailable(HasherBusy):
+    """
+    Raised when a worker process died or an operation timed out, the request should be retried later.
+    """
+    pass
+
+
+# run in the worker processes, so they have to be module level functions
+def _hash(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+def _check(pw_hash: str, password: str) -> bool:
+    try:
+        return bcrypt.checkpw(password.encode('utf-8'), pw_hash.encode('utf-8'))
+    except ValueError:  # not a bcrypt hash
+        return False
+
+
+def hash_rounds(pw_hash: str) -> Optional[int]:
+    """
+    Reads the work factor from a bcrypt hash, e.g. 12 from "$2b$12$...".
+    """
+    try:
+        return int(pw_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class OperationStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0  # [s]
+        self.max = 0.0  # [s]
+
+    def record(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "total": self.total,
+            "max": self.max,
+            "mean": self.total / self.count if self.count else 0.0,
+        }
+
+
+class PasswordHasher:
+    """
+    Hashes and verifies passwords in a process pool, so bcrypt doesn't hold up the request threads.
+    At most queue_limit operations can be running or waiting at once, further calls fail fast with HasherBusy.
+
+    Environment:
+        BCRYPT_ROUNDS:       work factor for new hashes (default 12)
+        BCRYPT_WORKERS:      worker processes, 0 hashes in the calling thread (default cpu count)
+        BCRYPT_QUEUE_LIMIT:  operations running or waiting at once (default 4 per worker)
+        BCRYPT_TIMEOUT:      seconds to wait for an operation, including its time in the queue (default 10)
+    """
+    def __init__(self, rounds: int = None, workers: int = None, queue_limit: int = None, timeout: float = None):
+        self.rounds = rounds if rounds is not None else int(os.environ.get("BCRYPT_ROUNDS", 12))
+        self.workers = workers if workers is not None else int(os.environ.get("BCRYPT_WORKERS", os.cpu_count() or 1))
+        self.queue_limit = queue_limit if queue_limit is not None else int(os.environ.get("BCRYPT_QUEUE_LIMIT", 4 * max(self.workers, 1)))
+        self.timeout = timeout if timeout is not None else float(os.environ.get("BCRYPT_TIMEOUT", 10))
+
+        self._slots = threading.BoundedSemaphore(self.queue_limit)
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None  # started on first use
+        self._stats = {"hash": OperationStats(), "check": OperationStats()}
+        self.rejected = 0
+
+    def _run(self, operation: str, function, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HasherBusy("Too many login requests, try again shortly")
+
+        start = time.perf_counter()
+        try:
+            if self.workers == 0:
+                return function(*args)
+            executor = self.executor()
+            try:
+                return executor.submit(function, *args).result(timeout=self.timeout)
+            except BrokenProcessPool:
+                self._replace(executor)  # a worker died, the pool refuses all further work
+                raise HasherUnavailable("Password hashing restarted, try again shortly")
+            except TimeoutError:
+                raise HasherUnavailable("Password hashing timed out, try again shortly")
+        finally:
+            self._slots.release()
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._stats[operation].record(elapsed)
+            metrics.record_bcrypt(operation, elapsed)
+
+    def executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _replace(self, executor: ProcessPoolExecutor):
+        # drops a broken pool, the next call starts a new one; other threads may have replaced it already
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def hash(self, password: str) -> str:
+        """
+        Hashes a password with the configured work factor.
+        """
+        return self._run("hash", _hash, password, self.rounds)
+
+    def check(self, pw_hash: str, password: str) -> bool:
+        """
+        Verifies a password against a stored hash.
+        """
+        return self._run("check", _check, pw_hash, password)
+
+    def needs_rehash(self, pw_hash: str) -> bool:
+        """
+        Whether a stored hash was made with a different work factor than the configured one.
+        """
+        return hash_rounds(pw_hash) != self.rounds
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "rounds": self.rounds,
+                "workers": self.workers,
+                "queue_limit": self.queue_limit,
+                "timeout": self.timeout,
+                "rejected": self.rejected,
+                **{operation: stats.as_dict() for operation, stats in self._stats.items()},
+            }
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
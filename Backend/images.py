@@ -0,0 +1,110 @@
+import hashlib
+import os
+import re
+import tempfile
+import time
+from typing import List, Set
+from flask import Response, send_from_directory
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from werkzeug.datastructures import FileStorage
+import models
+
+CHUNK_SIZE = 64 * 1024  # bytes read from an upload at a time
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60  # [s] content addressed images never change
+TEMP_PREFIX = ".upload-"
+GRACE_PERIOD = 60 * 60  # [s] files younger than this are never collected, their product may not be committed yet
+
+DEFAULT_IMAGE = "static/images/default.jpg"
+
+# stored uploads are named by the sha256 of their content
+CONTENT_ADDRESSED = re.compile(r"^([0-9a-f]{64})\.[a-z0-9]+$")
+
+
+def store_upload(file: FileStorage, folder: str) -> str:
+    """
+    Streams an upload to disk while hashing it, and stores it under the hash of its content.
+    Uploading the same image again reuses the stored file.
+
+    Args:
+        file (FileStorage): The uploaded file.
+        folder (str): The image folder.
+
+    Returns:
+        str: Path of the image, as stored in Product.image.
+    """
+    extension = os.path.splitext(file.filename)[1].lower()
+    digest = hashlib.sha256()
+    handle, temp_path = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=folder)
+    try:
+        with os.fdopen(handle, "wb") as temp:
+            while chunk := file.stream.read(CHUNK_SIZE):
+                digest.update(chunk)
+                temp.write(chunk)
+
+        name = digest.hexdigest() + extension
+        path = os.path.join(folder, name)
+        if os.path.exists(path):  # duplicate, keep the stored copy
+            os.remove(temp_path)
+            os.utime(path)  # restart the garbage collection grace period
+        else:
+            os.replace(temp_path, path)  # atomic, readers never see a partial file
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return f"static/images/{name}"
+
+
+def send_image(folder: str, filename: str) -> Response:
+    """
+    Serves an image. Content addressed images are cached as immutable, with their hash as ETag.
+    Other images (the seeded catalog images) get Flask's default caching.
+    """
+    match = CONTENT_ADDRESSED.match(filename)
+    if not match:
+        return send_from_directory(folder, filename)
+
+    response = send_from_directory(folder, filename, etag=match.group(1), max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def referenced_images(session: Session) -> Set[str]:
+    """
+    File names of every image a product refers to.
+    """
+    return {
+        os.path.basename(image)
+        for image in session.execute(select(models.Product.image)).scalars()
+        if image
+    }
+
+
+def collect_garbage(session: Session, folder: str, dry_run: bool = False) -> List[str]:
+    """
+    Removes stored uploads no product refers to, and unfinished uploads left behind by crashes.
+    Images that aren't content addressed (the seeded catalog images, default.jpg) are never removed,
+    and neither are files modified within the grace period.
+
+    Args:
+        session (Session): Database session to read Product.image with.
+        folder (str): The image folder.
+        dry_run (bool): Only list the files that would be removed.
+
+    Returns:
+        List[str]: Names of the removed files.
+    """
+    referenced = referenced_images(session)
+    now = time.time()
+    removed = []
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        if now - os.path.getmtime(path) < GRACE_PERIOD:
+            continue
+        if name.startswith(TEMP_PREFIX) or (CONTENT_ADDRESSED.match(name) and name not in referenced):
+            removed.append(name)
+            if not dry_run:
+                os.remove(path)
+    return removed
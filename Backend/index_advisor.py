@@ -0,0 +1,289 @@
+"""
+Index advisor: reports the query usage recorded by the app (see query_stats.py), suggests composite indexes
+for it, and benchmarks the recorded queries without and with the indexes, on a scaled up SQLite database.
+From the Backend folder:
+
+    curl -b cookies.txt http://localhost:5000/api/query/stats > stats.json
+    python index_advisor.py report --stats stats.json
+    python index_advisor.py suggest --stats stats.json --sql
+    python index_advisor.py benchmark --stats stats.json --factor 200 --orders 200000
+    python index_advisor.py apply
+
+Without --stats, the storefront's known workload (WORKLOAD) is used.
+apply creates the indexes declared in models.py on the configured database,
+create_all only adds them to tables it creates.
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List, Tuple
+from sqlalchemy import Index, create_engine, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.sql import operators
+import datagen
+import models
+from query_stats import EQUALITY_OPERATORS, RANGE_OPERATORS
+
+MIN_COUNT = 1  # query shapes used fewer times than this get no index
+LIMIT = 100  # rows fetched by ordered queries, like a page
+
+# query shapes of the storefront, in the format of QueryUsage.report()
+WORKLOAD = [
+    {"table": "product", "predicates": [["manufacturer_id", "=="]], "count": 100, "sample": {"manufacturer_id": 3}},
+    {"table": "product", "predicates": [["price", "range"]], "count": 100, "sample": {"price": [2.0, 4.0]}},
+    {"table": "product", "predicates": [["stock", "<="]], "count": 20, "sample": {"stock": 2}},
+    {"table": "product", "predicates": [["manufacturer_id", "=="], ["price", "order_by"]], "count": 50, "sample": {"manufacturer_id": 3}},
+    {"table": "order", "predicates": [["timestamp", "order_by"], ["user_id", "=="]], "count": 100, "sample": {"user_id": 4}},
+    {"table": "order", "predicates": [["timestamp", "range"]], "count": 10, "sample": {"timestamp": ["2024-03-01", "2024-03-08"]}},
+    {"table": "order_product", "predicates": [["order_id", "in"]], "count": 100, "sample": {"order_id": [1, 2, 3, 4, 5]}},
+]
+
+CONDITIONS = {  # the operators of filter_build
+    '>': operators.gt,
+    '<': operators.lt,
+    '>=': operators.ge,
+    '<=': operators.le,
+    '==': operators.eq,
+    '!=': operators.ne,
+    "in": operators.in_op,
+    "not_in": operators.notin_op,
+    "range": lambda column, value: column.between(*value),
+}
+
+
+def load_workload(path: str = None) -> List[dict]:
+    """
+    Reads the "shapes" of a saved /api/query/stats response, or returns WORKLOAD.
+    """
+    if path is None:
+        return WORKLOAD
+    with open(path) as file:
+        return json.load(file)["shapes"]
+
+
+def existing_indexes(table: models.Table) -> List[Tuple[str, ...]]:
+    """
+    Column lists of the indexes a table already has: its primary key, unique columns and declared indexes.
+    """
+    sa_table = table.cls.__table__
+    indexes = [tuple(column.name for column in sa_table.primary_key.columns)]
+    indexes += [(column.name,) for column in sa_table.columns if column.unique]
+    indexes += [tuple(column.name for column in index.columns) for index in sa_table.indexes]
+    return indexes
+
+
+def index_columns(shape: dict) -> Tuple[str, ...]:
+    """
+    Columns of the index serving a query shape: the equality columns, then one range or order_by column.
+    Columns compared with != or not_in can't use an index.
+    """
+    predicates = shape["predicates"]
+    equality = sorted({column for column, operator in predicates if operator in EQUALITY_OPERATORS})
+    ranges = [column for column, operator in predicates if operator in RANGE_OPERATORS and column not in equality]
+    # an order_by column after the equality columns saves the sort, prefer it over a range filter
+    ranges.sort(key=lambda column: [column, "order_by"] not in predicates)
+    return tuple(equality + ranges[:1])
+
+
+def covered(columns: Tuple[str, ...], indexes: List[Tuple[str, ...]]) -> bool:
+    """
+    An index covers a lookup if the lookup's columns are a prefix of it.
+    """
+    return any(index[:len(columns)] == columns for index in indexes)
+
+
+def suggest(shapes: List[dict], min_count: int = MIN_COUNT, include_existing: bool = False) -> List[dict]:
+    """
+    Suggests one index per table and column list the recorded queries would use.
+    Lookups by primary key, and column lists that are a prefix of another suggestion, are left out.
+
+    Args:
+        shapes (List[dict]): Query shapes as reported by QueryUsage.report().
+        min_count (int): Shapes used fewer times are ignored.
+        include_existing (bool): Also list indexes that already exist.
+
+    Returns:
+        List[dict]: table, columns, the queries served, and whether the index exists.
+    """
+    suggestions: Dict[Tuple[str, Tuple[str, ...]], int] = {}
+    for shape in shapes:
+        if shape["count"] < min_count:
+            continue
+        table = models.TABLES_GET(shape["table"])
+        columns = index_columns(shape)
+        if not columns or table is None or any(table.get_column(column) is None for column in columns):
+            continue
+        if table.get_column(columns[0]).primary_key:
+            continue
+        key = (table.table, columns)
+        suggestions[key] = suggestions.get(key, 0) + shape["count"]
+
+    result = []
+    for (table, columns), count in suggestions.items():
+        longer = [other for other_table, other in suggestions if other_table == table and other != columns and other[:len(columns)] == columns]
+        if longer:
+            continue
+        exists = covered(columns, existing_indexes(models.TABLES_GET(table)))
+        if exists and not include_existing:
+            continue
+        result.append({"table": table, "columns": list(columns), "queries": count, "exists": exists})
+    return sorted(result, key=lambda suggestion: -suggestion["queries"])
+
+
+def index_name(table: str, columns: List[str]) -> str:
+    return f"ix_{table}_{'_'.join(columns)}"
+
+
+def build_index(suggestion: dict) -> Index:
+    table = models.TABLES_GET(suggestion["table"]).cls.__table__
+    return Index(index_name(suggestion["table"], suggestion["columns"]), *(table.c[column] for column in suggestion["columns"]))
+
+
+def model_definition(suggestion: dict) -> str:
+    """
+    The suggestion as a line for the model's __table_args__ in models.py.
+    """
+    columns = ", ".join(f'"{column}"' for column in suggestion["columns"])
+    return f'{models.TABLES_GET(suggestion["table"]).name}: Index("{index_name(suggestion["table"], suggestion["columns"])}", {columns}),'
+
+
+def shape_query(shape: dict):
+    """
+    Rebuilds a recorded query from its shape, with the sample values recorded for it.
+    """
+    table = models.TABLES_GET(shape["table"])
+    query = select(table.cls.__table__)
+    for column, operator in shape["predicates"]:
+        inst = table.get_column(column).inst
+        if operator == "order_by":
+            query = query.order_by(inst).limit(LIMIT)
+            continue
+        value = shape["sample"][column]
+        if table.get_column(column).type is datetime:  # recorded as JSON strings
+            value = [datetime.fromisoformat(item) for item in value] if isinstance(value, list) else datetime.fromisoformat(value)
+        query = query.where(CONDITIONS[operator](inst, value))
+    return query
+
+
+def time_query(engine: Engine, query, repeat: int) -> float:
+    """
+    Median time of a query, fetching every row.
+    """
+    times = []
+    with engine.connect() as connection:
+        connection.execute(query).all()  # warm up the page cache
+        for _ in range(repeat):
+            start = time.perf_counter()
+            connection.execute(query).all()
+            times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def query_plan(engine: Engine, query) -> str:
+    with engine.connect() as connection:
+        compiled = query.compile(engine, compile_kwargs={"literal_binds": True})
+        return "; ".join(row[-1] for row in connection.execute(text(f"EXPLAIN QUERY PLAN {compiled}")))
+
+
+def describe(shape: dict) -> str:
+    return f"{shape['table']}: " + " and ".join(f"{column} {operator}" for column, operator in shape["predicates"])
+
+
+def report(shapes: List[dict]):
+    print(f"{'count':>8} {'mean ms':>9} {'max ms':>9}  query")
+    for shape in shapes:
+        mean = f"{shape['mean'] * 1000:9.2f}" if shape.get("mean") is not None else f"{'-':>9}"
+        maximum = f"{shape['max'] * 1000:9.2f}" if shape.get("max") else f"{'-':>9}"
+        print(f"{shape['count']:8} {mean} {maximum}  {describe(shape)}")
+
+
+def benchmark(shapes: List[dict], factor: int, users: int, orders: int, repeat: int):
+    """
+    Times every shape on a generated SQLite database with only the primary keys and unique constraints,
+    then again after creating the declared and suggested indexes.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        engine = create_engine(f"sqlite:///{os.path.join(folder, 'indexes.db')}")
+        models.Base.metadata.create_all(engine)
+        with Session(engine) as session:
+            datagen.generate(session, factor=factor, users=users, orders=orders)
+            session.commit()
+
+        declared = [index for table in models.Base.metadata.sorted_tables for index in table.indexes]
+        for index in declared:
+            index.drop(engine)
+        with engine.begin() as connection:
+            connection.execute(text("ANALYZE"))
+
+        queries = [(shape, shape_query(shape)) for shape in shapes if shape.get("sample") is not None]
+        before = [time_query(engine, query, repeat) for _, query in queries]
+
+        suggested = [build_index(suggestion) for suggestion in suggest(shapes)]
+        for index in declared + suggested:
+            index.create(engine)
+        with engine.begin() as connection:
+            connection.execute(text("ANALYZE"))
+        after = [time_query(engine, query, repeat) for _, query in queries]
+
+        print(f"{factor * 77} products, {users} customers, {orders} orders, median of {repeat}")
+        print(f"{'before ms':>10} {'after ms':>10} {'speedup':>8}  query / plan with indexes")
+        for (shape, query), old, new in zip(queries, before, after):
+            print(f"{old * 1000:10.3f} {new * 1000:10.3f} {old / new:7.1f}x  {describe(shape)}")
+            print(f"{'':31}{query_plan(engine, query)}")
+
+        for index in suggested:  # only exist for this benchmark
+            index.drop(engine)
+            index.table.indexes.discard(index)
+        engine.dispose()
+
+
+def apply():
+    """
+    Creates the indexes declared in models.py that the configured database doesn't have yet.
+    """
+    from dbcontext import DatabaseContext
+    engine = DatabaseContext.get_instance().engine
+    for table in models.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+            print(f"{index.name}: ok")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("report", "suggest", "benchmark", "apply"))
+    parser.add_argument("--stats", help="saved /api/query/stats response, instead of WORKLOAD")
+    parser.add_argument("--min-count", type=int, default=MIN_COUNT)
+    parser.add_argument("--all", action="store_true", help="suggest: also list indexes that already exist")
+    parser.add_argument("--sql", action="store_true", help="suggest: print CREATE INDEX statements")
+    parser.add_argument("--factor", type=int, default=100, help="benchmark: copies of the cereal catalog")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--orders", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.command == "apply":
+        apply()
+        return
+
+    shapes = load_workload(args.stats)
+    if args.command == "report":
+        report(shapes)
+    elif args.command == "suggest":
+        for suggestion in suggest(shapes, args.min_count, args.all):
+            if args.sql:
+                print(f"{CreateIndex(build_index(suggestion)).compile(create_engine('sqlite://'))};")
+            else:
+                print(f"{model_definition(suggestion):70} # {suggestion['queries']} queries{', exists' if suggestion['exists'] else ''}")
+    else:
+        benchmark(shapes, args.factor, args.users, args.orders, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
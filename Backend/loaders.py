@@ -0,0 +1,69 @@
+from typing import List, Optional
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.inspection import inspect as sa_inspect
+from models import Base
+
+
+def loader_strategy(relationship):
+    """
+    Picks the eager loading strategy for a relationship.
+    Scalar relationships (many-to-one, one-to-one) are joined into the parent query,
+    collections (one-to-many, many-to-many) are fetched with a single extra SELECT ... IN query.
+
+    Args:
+        relationship (RelationshipProperty): The relationship to load.
+
+    Returns:
+        function: joinedload or selectinload.
+    """
+    return selectinload if relationship.uselist else joinedload
+
+
+def loader_path(cls: Base, path: str):
+    """
+    Builds a chained loader option for a single dotted mapper path, e.g. "orders.order_products".
+
+    Args:
+        cls (Base): The table class the path starts from.
+        path (str): Dotted path of relationship names.
+
+    Returns:
+        Load | None: The loader option, or None if the path doesn't follow relationships.
+    """
+    option = None
+    for name in path.split('.'):
+        relationship = sa_inspect(cls).relationships.get(name)
+        if relationship is None:  # not a relationship, serialize_model skips it as well
+            return None
+
+        strategy = loader_strategy(relationship)
+        attribute = getattr(cls, name)
+        option = strategy(attribute) if option is None else getattr(option, strategy.__name__)(attribute)
+        cls = relationship.mapper.class_
+    return option
+
+
+def loader_plan(cls: Base, mappers: Optional[List[str]]) -> list:
+    """
+    Turns a list of dotted mapper paths into loader options for a query,
+    so serializing the mappers doesn't lazy load one row at a time.
+    Paths that are a prefix of another path are covered by the longer path and skipped.
+
+    Args:
+        cls (Base): The table class being queried.
+        mappers (List[str]): Mapper paths as given to serialize_model.
+
+    Returns:
+        list: Loader options to pass to Query.options().
+    """
+    if not mappers:
+        return []
+
+    paths = set(mappers)
+    leaves = [
+        path for path in paths
+        if not any(other.startswith(f"{path}.") for other in paths)
+    ]
+
+    options = (loader_path(cls, path) for path in sorted(leaves))
+    return [option for option in options if option is not None]
@@ -0,0 +1,236 @@
+"""
+Request metrics in the Prometheus text format: latency and status per endpoint, SQL queries, query time and rows
+per request, and time spent serializing and in bcrypt.
+
+Each process counts its own requests. Under serve.py, workers write their counts to METRICS_DIR every few seconds
+and /metrics adds up the files of every worker, including ones that exited, so counters never go backwards.
+
+Environment:
+    SLOW_REQUEST_MS:  log requests slower than this, with their SQL statements, to the "slow_requests" logger (default off)
+    METRICS_DIR:      folder the workers share their counts through, set by serve.py
+"""
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # [s]
+COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200)
+MAX_STATEMENTS = 50  # SQL statements kept per request for the slow request log
+DUMP_INTERVAL = 5.0  # [s] how often a worker writes its counts to METRICS_DIR
+
+slow_log = logging.getLogger("slow_requests")
+
+
+class Metric:
+    """
+    A counter or histogram with labels. Histogram series are [bucket counts..., sum, count], counter series [value].
+    """
+    def __init__(self, name: str, kind: str, help: str, labels: Tuple[str, ...], buckets: Tuple[float, ...] = ()):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def add(self, labels: Tuple[str, ...], value: float):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 2 if self.kind == "histogram" else 1)
+        if self.kind == "counter":
+            series[0] += value
+            return
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self, series: Dict[Tuple[str, ...], List[float]]) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, values in sorted(series.items()):
+            pairs = [f'{name}="{value}"' for name, value in zip(self.labels, labels)]
+            if self.kind == "counter":
+                lines.append(f"{self.name}{{{','.join(pairs)}}} {values[0]:g}")
+                continue
+            for bound, count in zip((*self.buckets, "+Inf"), (*values[:-2], values[-1])):
+                bucket = ",".join(pairs + [f'le="{bound}"'])
+                lines.append(f"{self.name}_bucket{{{bucket}}} {count:g}")
+            lines.append(f"{self.name}_sum{{{','.join(pairs)}}} {values[-2]:g}")
+            lines.append(f"{self.name}_count{{{','.join(pairs)}}} {values[-1]:g}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.metrics: Dict[str, Metric] = {}
+
+    def metric(self, name: str, kind: str, help: str, labels: Tuple[str, ...], buckets: Tuple[float, ...] = ()) -> Metric:
+        self.metrics[name] = Metric(name, kind, help, labels, buckets)
+        return self.metrics[name]
+
+    def add(self, metric: Metric, labels: Tuple[str, ...], value: float):
+        with self._lock:
+            metric.add(labels, value)
+
+    def state(self) -> Dict[str, Dict[Tuple[str, ...], List[float]]]:
+        with self._lock:
+            return {name: {labels: list(values) for labels, values in metric.series.items()} for name, metric in self.metrics.items()}
+
+    def dump(self, folder: str):
+        """
+        Writes this process's counts to folder/<pid>.json, replacing the previous ones.
+        """
+        state = {name: [[list(labels), values] for labels, values in series.items()] for name, series in self.state().items()}
+        path = os.path.join(folder, f"{os.getpid()}.json")
+        with open(path + ".tmp", "w") as file:
+            json.dump(state, file)
+        os.replace(path + ".tmp", path)
+
+    def collect(self, folder: Optional[str]) -> Dict[str, Dict[Tuple[str, ...], List[float]]]:
+        """
+        This process's counts, plus the counts the other processes wrote to folder.
+        """
+        total = self.state()
+        if not folder or not os.path.isdir(folder):
+            return total
+        own = f"{os.getpid()}.json"
+        for name in os.listdir(folder):
+            if name == own or not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(folder, name)) as file:
+                    state = json.load(file)
+            except (OSError, ValueError):  # being replaced
+                continue
+            for metric, series in state.items():
+                for labels, values in series:
+                    current = total.setdefault(metric, {}).setdefault(tuple(labels), [0] * len(values))
+                    for index, value in enumerate(values):
+                        current[index] += value
+        return total
+
+    def render(self, folder: Optional[str] = None) -> str:
+        state = self.collect(folder)
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.extend(metric.render(state.get(name, {})))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+REQUESTS = registry.metric("http_requests_total", "counter", "Requests by endpoint, method and status.", ("endpoint", "method", "status"))
+LATENCY = registry.metric("http_request_duration_seconds", "histogram", "Request latency.", ("endpoint", "method"), LATENCY_BUCKETS)
+QUERIES = registry.metric("db_queries_per_request", "histogram", "SQL statements executed per request.", ("endpoint",), COUNT_BUCKETS)
+QUERY_TIME = registry.metric("db_query_duration_seconds", "histogram", "Time spent in SQL per request.", ("endpoint",), LATENCY_BUCKETS)
+ROWS = registry.metric("db_rows_total", "counter", "Rows returned or changed, as reported by the driver (SQLite only reports changes).", ("endpoint",))
+SERIALIZATION = registry.metric("serialization_duration_seconds", "histogram", "Time spent serializing models per request.", ("endpoint",), LATENCY_BUCKETS)
+BCRYPT = registry.metric("bcrypt_duration_seconds", "histogram", "Password hashing and checking, including time queued.", ("operation",), LATENCY_BUCKETS)
+
+
+class RequestStats:
+    """
+    What one request spent its time on, collected by the hooks below while it runs.
+    """
+    def __init__(self, endpoint: str, method: str, path: str, keep_statements: bool):
+        self.endpoint = endpoint
+        self.method = method
+        self.path = path
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.query_time = 0.0
+        self.rows = 0
+        self.serialization = 0.0
+        self.bcrypt = 0.0
+        self.statements: Optional[List[Tuple[str, float]]] = [] if keep_statements else None
+
+
+_current = threading.local()
+
+
+def slow_threshold() -> Optional[float]:
+    milliseconds = float(os.environ.get("SLOW_REQUEST_MS", 0))
+    return milliseconds / 1000 if milliseconds > 0 else None
+
+
+def begin(endpoint: str, method: str, path: str):
+    """
+    Starts collecting a request's stats, in the thread handling it.
+    """
+    _current.stats = RequestStats(endpoint, method, path, keep_statements=slow_threshold() is not None)
+
+
+def current() -> Optional[RequestStats]:
+    return getattr(_current, "stats", None)
+
+
+def end(status: int):
+    """
+    Records the finished request, and logs it if it was slow.
+    """
+    stats = current()
+    if stats is None:
+        return
+    _current.stats = None
+    elapsed = time.perf_counter() - stats.start
+    registry.add(REQUESTS, (stats.endpoint, stats.method, str(status)), 1)
+    registry.add(LATENCY, (stats.endpoint, stats.method), elapsed)
+    registry.add(QUERIES, (stats.endpoint,), stats.queries)
+    registry.add(QUERY_TIME, (stats.endpoint,), stats.query_time)
+    registry.add(ROWS, (stats.endpoint,), stats.rows)
+    registry.add(SERIALIZATION, (stats.endpoint,), stats.serialization)
+
+    threshold = slow_threshold()
+    if threshold is not None and elapsed > threshold:
+        statements = "".join(f"\n    {seconds * 1000:8.2f} ms  {' '.join(statement.split())}" for statement, seconds in stats.statements or [])
+        slow_log.warning(
+            "%s %s (%s) %d in %.1f ms: %d queries %.1f ms, %d rows, serialization %.1f ms, bcrypt %.1f ms%s",
+            stats.method, stats.path, stats.endpoint, status, elapsed * 1000, stats.queries, stats.query_time * 1000,
+            stats.rows, stats.serialization * 1000, stats.bcrypt * 1000, statements,
+        )
+
+
+def record_query(statement: str, seconds: float, rows: int):
+    """
+    Called by DatabaseContext after every SQL statement.
+    """
+    stats = current()
+    if stats is None:
+        return
+    stats.queries += 1
+    stats.query_time += seconds
+    stats.rows += max(rows, 0)  # -1 when the driver doesn't know
+    if stats.statements is not None and len(stats.statements) < MAX_STATEMENTS:
+        stats.statements.append((statement, seconds))
+
+
+def record_serialization(seconds: float):
+    stats = current()
+    if stats is not None:
+        stats.serialization += seconds
+
+
+def record_bcrypt(operation: str, seconds: float):
+    registry.add(BCRYPT, (operation,), seconds)
+    stats = current()
+    if stats is not None:
+        stats.bcrypt += seconds
+
+
+def start_dumping(folder: str, interval: float = DUMP_INTERVAL) -> threading.Event:
+    """
+    Writes this process's counts to folder every interval seconds, until the returned event is set.
+    Dump once more after setting it, so the last requests are counted.
+    """
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            registry.dump(folder)
+
+    threading.Thread(target=run, name="metrics", daemon=True).start()
+    return stop
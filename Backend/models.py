@@ -1,7 +1,7 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Set, List, Optional
-from sqlalchemy import ForeignKey, String
+from typing import Dict, Set, List, Optional
+from sqlalchemy import ForeignKey, Index, String
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from sqlalchemy.sql.schema import Column, ForeignKey
 
@@ -26,8 +26,8 @@ class Product(Base):
     name: Mapped[str] = mapped_column(String(50))
     image: Mapped[str] = mapped_column(String(300))
 
-    stock: Mapped[int] = mapped_column(default=0)
-    price: Mapped[float]
+    stock: Mapped[int] = mapped_column(default=0, index=True)
+    price: Mapped[float] = mapped_column(index=True)
 
     manufacturer_id: Mapped[int] = mapped_column(ForeignKey("manufacturer.id"))
     manufacturer: Mapped["Manufacturer"] = relationship(back_populates="products")
@@ -39,6 +39,11 @@ class Product(Base):
         back_populates="product", cascade="all, delete-orphan"
     )
 
+    # indexes for the storefront filters, see index_advisor.py
+    __table_args__ = (
+        Index("ix_product_manufacturer_id_price", "manufacturer_id", "price"),  # a manufacturer's products, by price
+    )
+
 class ProductDetails(Base):
     __tablename__ = "product_details"
     id: Mapped[int] = mapped_column(primary_key=True)
@@ -62,9 +67,9 @@ class ProductDetails(Base):
 class OrderProduct(Base):
     __tablename__ = "order_product"
     id: Mapped[int] = mapped_column(primary_key=True)
-    order_id: Mapped[int] = mapped_column(ForeignKey("order.id"))
+    order_id: Mapped[int] = mapped_column(ForeignKey("order.id"), index=True)
     order: Mapped["Order"] = relationship(back_populates="order_products")
-    product_id: Mapped[int] = mapped_column(ForeignKey("product.id"))
+    product_id: Mapped[int] = mapped_column(ForeignKey("product.id"), index=True)
     product: Mapped["Product"] = relationship(back_populates="order_products")
     quantity: Mapped[int]
 
@@ -79,7 +84,7 @@ class Order(Base):
     name: Mapped[str] = mapped_column(String(100))
     address: Mapped[str] = mapped_column(String(100))
 
-    timestamp: Mapped[datetime]
+    timestamp: Mapped[datetime] = mapped_column(index=True)
     price: Mapped[float]
     status: Mapped[str] = mapped_column(String(30))
 
@@ -87,6 +92,10 @@ class Order(Base):
         back_populates="order", cascade="all, delete-orphan"
     )
 
+    __table_args__ = (
+        Index("ix_order_user_id_timestamp", "user_id", "timestamp"),  # a user's order history, newest first
+    )
+
 class User(Base):
     __tablename__ = "user"
     id: Mapped[int] = mapped_column(primary_key=True)
@@ -118,13 +127,23 @@ class Table:
     table: str  # table name
     polymorphic: Optional[str] # column name for inheritance identity
     columns: List[TableColumn]  # database columns
+    column_index: Dict[str, TableColumn] = field(default_factory=dict, repr=False)  # column and mapper names -> column
+    relationships: Dict[str, "Table"] = field(default_factory=dict, repr=False)  # relationship name -> target table
+
+    def __post_init__(self):
+        # index column names first, so a column name always wins over a mapper name
+        for column in self.columns:
+            self.column_index.setdefault(column.name, column)
+        for column in self.columns:
+            if column.mapper:
+                self.column_index.setdefault(column.mapper, column)
 
     def matches_name(self, name: str) -> bool:
         lower = name.lower()
         return self.name.lower() == lower or self.table.lower() == lower
 
     def get_column(self, name: str) -> Optional[TableColumn]:
-        return next(filter(lambda c: c.name == name or c.mapper == name, self.columns), None)
+        return self.column_index.get(name)
 
 
 # generate list of Table's from module definitions
@@ -183,14 +202,29 @@ def __get_tables__() -> List[Table]:
             columns,
         ))
 
+    # link relationships to their target tables, once every table exists
+    by_cls = {table.cls: table for table in tables}
+    for table in tables:
+        for name, relationship in sa_inspect(table.cls).relationships.items():
+            table.relationships[name] = by_cls[relationship.mapper.class_]
+
     return tables
 
 # list of tables in module
 TABLES = __get_tables__()
 
+# table lookup index, both class names and table names in lowercase
+TABLES_BY_NAME: Dict[str, Table] = {
+    **{table.table.lower(): table for table in TABLES},
+    **{table.name.lower(): table for table in TABLES},
+}
+
 # easy table lookup with table names
 def TABLES_GET(name: str) -> Optional[Table]:
-    return next(filter(lambda t: t.matches_name(name), TABLES), None)
+    table = TABLES_BY_NAME.get(name)
+    if table is None:
+        table = TABLES_BY_NAME.get(name.lower())
+    return table
 
 if __name__ == '__main__':
     from pprint import pp as pprint
@@ -0,0 +1,127 @@
+import base64
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional, Tuple
+from sqlalchemy import and_, or_
+import models
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+PAGE_KEYS = ("limit", "order_by", "cursor")  # request body keys that aren't filters
+
+""" JSON pagination exempel:
+body = {
+    "limit":    50,             # antal rækker per side, højst MAX_LIMIT
+    "order_by": "-price",       # kolonne at sortere efter, - foran for faldende
+    "cursor":   "eyJvIjog...",  # next_cursor fra forrige svar
+    "stock":    [">", 0],       # filtre virker som før
+}
+"""
+
+
+def encode_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def decode_value(column: models.TableColumn, value):
+    return datetime.fromisoformat(value) if column.type is datetime else value
+
+
+@dataclass
+class Page:
+    table: models.Table
+    limit: int
+    order_by: models.TableColumn
+    descending: bool
+    after: Optional[Tuple]  # (order_by value, primary key) of the last row on the previous page
+
+    @staticmethod
+    def from_request(table: models.Table, info: dict) -> Optional["Page"]:
+        """
+        Pops the pagination keys from a request body.
+
+        Args:
+            table (Table): Registry entry of the queried table.
+            info (dict): The request body, pagination keys are removed from it.
+
+        Returns:
+            Page | None: The requested page, or None if the request isn't paginated.
+        """
+        if not any(key in info for key in PAGE_KEYS):
+            return None
+
+        limit = int(info.pop("limit", DEFAULT_LIMIT))
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        limit = min(limit, MAX_LIMIT)
+
+        order_by = info.pop("order_by", "id")
+        descending = order_by.startswith("-")
+        column = table.get_column(order_by.lstrip("-"))
+        if column is None:
+            raise ValueError(f"Invalid order_by: {order_by}")
+        if column.optional:
+            raise ValueError(f"Can't paginate on nullable column: {column.name}")
+
+        after = None
+        if cursor := info.pop("cursor", None):
+            try:
+                state = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            except ValueError:
+                raise ValueError("Invalid cursor")
+            # cursor() stores the resolved column, e.g. manufacturer_id for order_by "manufacturer"
+            if state.get("o") != (f"-{column.name}" if descending else column.name):
+                raise ValueError("Cursor doesn't match order_by")
+            value, key = state["v"]
+            after = (decode_value(column, value), key)
+
+        return Page(table, limit, column, descending, after)
+
+    @property
+    def primary_key(self) -> models.TableColumn:
+        return self.table.get_column("id")
+
+    def apply(self, query):
+        """
+        Orders, seeks past the cursor and limits a query.
+        The primary key breaks ties, so rows with equal order_by values are neither skipped nor repeated.
+        One row more than the limit is fetched to tell if there's a next page.
+        """
+        column, key = self.order_by.inst, self.primary_key.inst
+
+        if self.after is not None:
+            value, last_key = self.after
+            if column is key:
+                query = query.filter(key < last_key if self.descending else key > last_key)
+            elif self.descending:
+                query = query.filter(or_(column < value, and_(column == value, key < last_key)))
+            else:
+                query = query.filter(or_(column > value, and_(column == value, key > last_key)))
+
+        if self.descending:
+            order = [column.desc()] if column is key else [column.desc(), key.desc()]
+        else:
+            order = [column] if column is key else [column, key]
+
+        return query.order_by(*order).limit(self.limit + 1)
+
+    def cursor(self, rows: list) -> Optional[str]:
+        """
+        Builds the cursor pointing past the last row of a page.
+        """
+        if len(rows) <= self.limit:
+            return None
+        last = rows[self.limit - 1]
+        order_by = f"-{self.order_by.name}" if self.descending else self.order_by.name
+        state = {
+            "o": order_by,
+            "v": [encode_value(getattr(last, self.order_by.name)), getattr(last, self.primary_key.name)],
+        }
+        return base64.urlsafe_b64encode(json.dumps(state).encode()).decode()
+
+    def result(self, rows: list) -> Tuple[List, Optional[str]]:
+        """
+        Splits the fetched rows into the page rows and the next cursor.
+        """
+        return rows[:self.limit], self.cursor(rows)
@@ -0,0 +1,90 @@
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+# operators that pin a column to values, the leading columns of a composite index
+EQUALITY_OPERATORS = {"==", "in"}
+# operators that scan a range of a column, at most one of them can use an index after the equality columns
+RANGE_OPERATORS = {">", "<", ">=", "<=", "range", "order_by"}
+
+Predicate = Tuple[str, str]  # (column, operator)
+
+
+class ShapeStats:
+    """
+    Usage of one query shape: a table and the set of (column, operator) predicates filtering it.
+    """
+    def __init__(self):
+        self.count = 0
+        self.timed = 0
+        self.total = 0.0  # [s]
+        self.max = 0.0  # [s]
+        self.sample: Dict[str, object] = {}  # last value seen per column, used to benchmark the shape
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "total": self.total,
+            "max": self.max,
+            "mean": self.total / self.timed if self.timed else None,
+            "sample": self.sample,
+        }
+
+
+class QueryUsage:
+    """
+    Records which columns and operators the endpoints filter and sort on, how often, and how long the queries take.
+    The report feeds index_advisor.py.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._shapes: Dict[Tuple[str, Tuple[Predicate, ...]], ShapeStats] = {}
+
+    def record(self, table: str, predicates: Iterable[Tuple[str, str, object]], seconds: float = None):
+        """
+        Records one query.
+
+        Args:
+            table (str): Table name.
+            predicates (Iterable): (column, operator, value) for every filter and the order_by column.
+            seconds (float): Time the query took, if measured.
+        """
+        predicates = list(predicates)
+        shape = (table, tuple(sorted({(column, operator) for column, operator, _ in predicates})))
+        with self._lock:
+            stats = self._shapes.get(shape)
+            if stats is None:
+                stats = self._shapes[shape] = ShapeStats()
+            stats.count += 1
+            if seconds is not None:
+                stats.timed += 1
+                stats.total += seconds
+                stats.max = max(stats.max, seconds)
+            for column, _, value in predicates:
+                stats.sample[column] = value
+
+    def report(self) -> List[dict]:
+        """
+        Returns:
+            List[dict]: One entry per query shape, most used first.
+        """
+        with self._lock:
+            entries = [
+                {"table": table, "predicates": [list(predicate) for predicate in predicates], **stats.as_dict()}
+                for (table, predicates), stats in self._shapes.items()
+            ]
+        return sorted(entries, key=lambda entry: -entry["count"])
+
+    def columns(self) -> List[dict]:
+        """
+        Returns:
+            List[dict]: Use count per (table, column, operator), most used first.
+        """
+        counts: Dict[Tuple[str, str, str], int] = {}
+        with self._lock:
+            for (table, predicates), stats in self._shapes.items():
+                for column, operator in predicates:
+                    counts[(table, column, operator)] = counts.get((table, column, operator), 0) + stats.count
+        return [
+            {"table": table, "column": column, "operator": operator, "count": count}
+            for (table, column, operator), count in sorted(counts.items(), key=lambda item: -item[1])
+        ]
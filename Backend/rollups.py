@@ -0,0 +1,308 @@
+"""
+Sales rollups: running totals per product, and per product and day, updated by /api/order in the order's
+transaction. The analytics endpoints answer from them without scanning order and order_product.
+The tables live here rather than in models.py, so the generic /api/get endpoints don't serve them.
+
+Recompute them from the raw orders, from the Backend folder:
+
+    python rollups.py check     # lists products whose rollups differ from the raw orders
+    python rollups.py rebuild   # replaces the rollups with the recomputed ones
+"""
+import argparse
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+import polars as pl
+from sqlalchemy import Index, delete, func, insert, select, update
+from sqlalchemy.orm import Mapped, Session, mapped_column
+from models import Base, Manufacturer, Order, OrderProduct, Product
+
+BUCKETS = ("day", "week", "month")
+TOLERANCE = 1e-6  # revenue differences below this are rounding
+
+
+class ProductSales(Base):
+    __tablename__ = "product_sales"
+    product_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)  # no foreign key, sales outlive deleted products
+    quantity: Mapped[int]  # units sold
+    revenue: Mapped[float]
+    orders: Mapped[int]  # orders containing the product
+
+    __table_args__ = (
+        Index("ix_product_sales_quantity", "quantity"),  # top sellers
+    )
+
+
+class DailySales(Base):
+    __tablename__ = "daily_sales"
+    day: Mapped[date] = mapped_column(primary_key=True)
+    product_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    manufacturer_id: Mapped[int]  # at the time of the order
+    quantity: Mapped[int]
+    revenue: Mapped[float]
+
+
+SUMS = {  # columns added up when a rollup row already exists
+    ProductSales: ("quantity", "revenue", "orders"),
+    DailySales: ("quantity", "revenue"),
+}
+
+
+def upsert(session: Session, model, rows: List[dict]):
+    """
+    Inserts rollup rows, adding their sums to the rows that already exist.
+    Uses the dialect's native upsert, so concurrent orders for the same product can't insert the same key twice.
+    """
+    table = model.__table__
+    sums = SUMS[model]
+    dialect = session.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        statement = dialect_insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[column.name for column in table.primary_key.columns],
+            set_={name: table.c[name] + statement.excluded[name] for name in sums},
+        )
+        session.execute(statement, rows)
+    elif dialect in ("mysql", "mariadb"):
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+        statement = dialect_insert(table)
+        statement = statement.on_duplicate_key_update({name: table.c[name] + statement.inserted[name] for name in sums})
+        session.execute(statement, rows)
+    else:  # update what exists, insert the rest
+        for row in rows:
+            keys = [table.c[column.name] == row[column.name] for column in table.primary_key.columns]
+            result = session.execute(update(table).where(*keys).values({name: table.c[name] + row[name] for name in sums}))
+            if result.rowcount == 0:
+                session.execute(insert(table), [row])
+
+
+def record_order(session: Session, timestamp: datetime, lines: Iterable[Tuple[int, int, int, float]]):
+    """
+    Adds an order to the rollups, in the order's transaction.
+
+    Args:
+        session (Session): The session the order is written in.
+        timestamp (datetime): Order.timestamp.
+        lines (Iterable): (product_id, manufacturer_id, quantity, unit price) per product in the order.
+    """
+    lines = list(lines)
+    upsert(session, ProductSales, [
+        {"product_id": product_id, "quantity": quantity, "revenue": quantity * price, "orders": 1}
+        for product_id, _, quantity, price in lines
+    ])
+    upsert(session, DailySales, [
+        {"day": timestamp.date(), "product_id": product_id, "manufacturer_id": manufacturer_id,
+         "quantity": quantity, "revenue": quantity * price}
+        for product_id, manufacturer_id, quantity, price in lines
+    ])
+
+
+# analytics
+
+def since(days: Optional[int], today: date = None) -> Optional[date]:
+    """
+    First day of a window of days ending today, None for all time.
+    """
+    if days is None:
+        return None
+    if days < 1:
+        raise ValueError("days must be positive")
+    return (today or date.today()) - timedelta(days=days - 1)
+
+
+def top_sellers(session: Session, limit: int = 10, days: Optional[int] = None) -> List[dict]:
+    """
+    Products with the most units sold, all time or in the last days.
+    """
+    if days is None:
+        sales = select(ProductSales.product_id, ProductSales.quantity, ProductSales.revenue).order_by(ProductSales.quantity.desc())
+    else:
+        quantity = func.sum(DailySales.quantity).label("quantity")
+        sales = (
+            select(DailySales.product_id, quantity, func.sum(DailySales.revenue).label("revenue"))
+            .where(DailySales.day >= since(days))
+            .group_by(DailySales.product_id)
+            .order_by(quantity.desc())
+        )
+    sales = sales.limit(limit).subquery()
+    rows = session.execute(
+        select(sales.c.product_id, Product.name, sales.c.quantity, sales.c.revenue)
+        .outerjoin(Product, Product.id == sales.c.product_id)
+        .order_by(sales.c.quantity.desc(), sales.c.product_id)
+    ).all()
+    return [
+        {"product_id": product_id, "name": name, "quantity": quantity, "revenue": revenue}
+        for product_id, name, quantity, revenue in rows
+    ]
+
+
+def bucket_start(day: date, bucket: str) -> date:
+    if bucket == "week":
+        return day - timedelta(days=day.weekday())
+    if bucket == "month":
+        return day.replace(day=1)
+    return day
+
+
+def revenue_by_manufacturer(session: Session, days: int = 30, bucket: str = "day") -> List[dict]:
+    """
+    Revenue and units sold per manufacturer, per day, week or month of the last days.
+
+    Returns:
+        List[dict]: One entry per manufacturer, with its totals and buckets oldest first.
+    """
+    if bucket not in BUCKETS:
+        raise ValueError(f"bucket must be one of {', '.join(BUCKETS)}")
+    rows = session.execute(
+        select(DailySales.day, DailySales.manufacturer_id, func.sum(DailySales.quantity), func.sum(DailySales.revenue))
+        .where(DailySales.day >= since(days))
+        .group_by(DailySales.day, DailySales.manufacturer_id)
+    ).all()
+    names = dict(session.execute(select(Manufacturer.id, Manufacturer.name)).all())
+
+    buckets: Dict[int, Dict[date, List]] = defaultdict(lambda: defaultdict(lambda: [0, 0.0]))
+    for day, manufacturer_id, quantity, revenue in rows:
+        totals = buckets[manufacturer_id][bucket_start(day, bucket)]
+        totals[0] += quantity
+        totals[1] += revenue
+
+    result = [
+        {
+            "manufacturer_id": manufacturer_id,
+            "name": names.get(manufacturer_id),
+            "quantity": sum(quantity for quantity, _ in periods.values()),
+            "revenue": sum(revenue for _, revenue in periods.values()),
+            "buckets": [
+                {"start": start.isoformat(), "quantity": quantity, "revenue": revenue}
+                for start, (quantity, revenue) in sorted(periods.items())
+            ],
+        }
+        for manufacturer_id, periods in buckets.items()
+    ]
+    return sorted(result, key=lambda entry: -entry["revenue"])
+
+
+def burn_rate(session: Session, days: int = 30, limit: int = 20) -> List[dict]:
+    """
+    Units sold per day over the last days, and how many days the current stock lasts at that rate.
+    The products running out first are listed first.
+    """
+    sold = (
+        select(DailySales.product_id, func.sum(DailySales.quantity).label("quantity"))
+        .where(DailySales.day >= since(days))
+        .group_by(DailySales.product_id)
+        .subquery()
+    )
+    rows = session.execute(
+        select(Product.id, Product.name, Product.stock, sold.c.quantity)
+        .join(sold, sold.c.product_id == Product.id)
+    ).all()
+    result = []
+    for id, name, stock, quantity in rows:
+        rate = quantity / days
+        result.append({
+            "product_id": id,
+            "name": name,
+            "stock": stock,
+            "sold": quantity,
+            "per_day": rate,
+            "days_left": stock / rate,
+        })
+    result.sort(key=lambda entry: (entry["days_left"], -entry["per_day"]))
+    return result[:limit]
+
+
+# rebuilding from the raw orders
+
+def compute(session: Session) -> Tuple[pl.DataFrame, pl.DataFrame]:
+    """
+    Recomputes the rollups from order and order_product.
+    Order lines don't store their unit price, so each order's total is split over its lines by the current
+    product prices. This equals the incremental rollups unless prices changed after the order.
+
+    Returns:
+        Tuple[pl.DataFrame, pl.DataFrame]: product_sales and daily_sales rows.
+    """
+    rows = session.execute(
+        select(Order.id, Order.timestamp, Order.price, OrderProduct.product_id, Product.manufacturer_id,
+               OrderProduct.quantity, Product.price)
+        .join(OrderProduct, OrderProduct.order_id == Order.id)
+        .join(Product, Product.id == OrderProduct.product_id)
+    ).all()
+    schema = {"order_id": pl.Int64, "timestamp": pl.Datetime, "total": pl.Float64, "product_id": pl.Int64,
+              "manufacturer_id": pl.Int64, "quantity": pl.Int64, "price": pl.Float64}
+    lines = pl.DataFrame(rows, schema=schema, orient="row")
+
+    # an order can list a product on several lines, the rollups count it once per order
+    lines = lines.group_by("order_id", "timestamp", "total", "product_id", "manufacturer_id", "price").agg(pl.col("quantity").sum())
+    value = pl.col("quantity") * pl.col("price")
+    lines = lines.with_columns(
+        (pl.col("total") * value / value.sum().over("order_id")).fill_nan(0.0).alias("revenue"),
+        pl.col("timestamp").dt.date().alias("day"),
+    )
+
+    product_sales = lines.group_by("product_id").agg(
+        pl.col("quantity").sum(), pl.col("revenue").sum(), pl.len().alias("orders"),
+    ).with_columns(pl.col("orders").cast(pl.Int64))
+    daily_sales = lines.group_by("day", "product_id").agg(
+        pl.col("manufacturer_id").first(), pl.col("quantity").sum(), pl.col("revenue").sum(),
+    )
+    return product_sales, daily_sales
+
+
+def rebuild(session: Session):
+    """
+    Replaces the rollups with ones recomputed from the raw orders, in the session's transaction.
+    """
+    product_sales, daily_sales = compute(session)
+    session.execute(delete(ProductSales))
+    session.execute(delete(DailySales))
+    if product_sales.height:
+        session.execute(insert(ProductSales), product_sales.to_dicts())
+    if daily_sales.height:
+        session.execute(insert(DailySales), daily_sales.to_dicts())
+
+
+def check(session: Session) -> List[dict]:
+    """
+    Compares the per product rollups with the raw orders.
+
+    Returns:
+        List[dict]: Products whose quantity, revenue or order count differ, stored next to recomputed.
+    """
+    expected, _ = compute(session)
+    stored = pl.DataFrame(
+        session.execute(select(ProductSales.product_id, ProductSales.quantity, ProductSales.revenue, ProductSales.orders)).all(),
+        schema={"product_id": pl.Int64, "quantity": pl.Int64, "revenue": pl.Float64, "orders": pl.Int64},
+        orient="row",
+    )
+    joined = stored.join(expected, on="product_id", how="full", suffix="_expected", coalesce=True).fill_null(0)
+    differences = joined.filter(
+        (pl.col("quantity") != pl.col("quantity_expected"))
+        | (pl.col("orders") != pl.col("orders_expected"))
+        | ((pl.col("revenue") - pl.col("revenue_expected")).abs() > TOLERANCE)
+    )
+    return differences.sort("product_id").to_dicts()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("check", "rebuild"))
+    args = parser.parse_args()
+
+    from dbcontext import DatabaseContext
+    with DatabaseContext.get_instance().get_session() as session:
+        if args.command == "rebuild":
+            rebuild(session)
+            session.commit()
+            print("rebuilt")
+        for difference in check(session):
+            print(difference)
+
+
+if __name__ == "__main__":
+    main()
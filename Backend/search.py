@@ -0,0 +1,288 @@
+import bisect
+import heapq
+import re
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+import models
+
+MAX_EXPANSIONS = 50  # vocabulary tokens a prefix or typo can expand to
+MAX_PREFIX_SCAN = 5000  # vocabulary tokens looked at for a short prefix, the most used are kept
+MIN_FUZZY_LENGTH = 3  # shorter terms only match exactly or as a prefix
+NAME_WEIGHT = 2.0  # matches in the product name rank above matches in the manufacturer name
+MANUFACTURER_WEIGHT = 1.0
+
+# score of a term matching a token
+EXACT_SCORE = 1.0
+PREFIX_SCORE = 0.8
+FUZZY_SCORE = 0.5
+
+TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN.findall(text.lower())
+
+
+def trigrams(token: str) -> Set[str]:
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    Levenshtein distance, giving up with limit + 1 as soon as it's known to exceed limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+@dataclass
+class Document:
+    id: int
+    name: str
+    image: str
+    price: float
+    manufacturer_id: int
+    details_id: int
+    manufacturer: str
+    tokens: Dict[str, float]  # token -> field weight
+
+    def summary(self, score: float) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "image": self.image,
+            "price": self.price,
+            "manufacturer_id": self.manufacturer_id,
+            "manufacturer": self.manufacturer,
+            "score": round(score, 3),
+        }
+
+
+class SearchIndex:
+    """
+    In-memory index over product and manufacturer names, for search as you type.
+    Terms match tokens exactly, as a prefix (the last term, which is still being typed),
+    or with a typo, found through a trigram index over the vocabulary.
+    Built from the database on first use and kept current by the write endpoints.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.built = False
+        self.version = None  # catalog version the index reflects, kept by backend.current_index
+        self._documents: Dict[int, Document] = {}
+        self._manufacturers: Dict[int, str] = {}
+        self._postings: Dict[str, Dict[float, Set[int]]] = {}  # token -> field weight -> product ids
+        self._vocabulary: List[str] = []  # sorted tokens, for prefix lookups
+        self._trigrams: Dict[str, Set[str]] = {}  # trigram -> tokens
+
+    # index maintenance
+
+    def build(self, session: Session):
+        """
+        (Re)builds the index from the database.
+        """
+        rows = session.execute(
+            select(models.Product.id, models.Product.name, models.Product.image, models.Product.price,
+                   models.Product.details_id, models.Manufacturer.id, models.Manufacturer.name)
+            .join(models.Manufacturer, models.Product.manufacturer_id == models.Manufacturer.id)
+        ).all()
+        with self._lock:
+            self._documents.clear()
+            self._manufacturers.clear()
+            self._postings.clear()
+            self._vocabulary.clear()
+            self._trigrams.clear()
+            for id, name, image, price, details_id, manufacturer_id, manufacturer in rows:
+                self._manufacturers[manufacturer_id] = manufacturer
+                self._add(id, name, image, price, details_id, manufacturer_id)
+            self.built = True
+
+    def ensure_built(self, session: Session):
+        if not self.built:
+            self.build(session)
+
+    def invalidate(self):
+        """
+        Marks the index for a full rebuild on the next search, for writes that don't report their ids.
+        """
+        self.built = False
+
+    def _add(self, id: int, name: str, image: str, price: float, details_id: int, manufacturer_id: int):
+        manufacturer = self._manufacturers.get(manufacturer_id, "")
+        tokens = {token: MANUFACTURER_WEIGHT for token in tokenize(manufacturer)}
+        tokens.update({token: NAME_WEIGHT for token in tokenize(name)})
+        self._documents[id] = Document(id, name, image, price, manufacturer_id, details_id, manufacturer, tokens)
+        for token, weight in tokens.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                bisect.insort(self._vocabulary, token)
+                for gram in trigrams(token):
+                    self._trigrams.setdefault(gram, set()).add(token)
+            postings.setdefault(weight, set()).add(id)
+
+    def _remove(self, id: int):
+        document = self._documents.pop(id, None)
+        if document is None:
+            return
+        for token, weight in document.tokens.items():
+            postings = self._postings[token]
+            postings[weight].discard(id)
+            if not postings[weight]:
+                del postings[weight]
+            if not postings:  # token no longer used, drop it from the vocabulary
+                del self._postings[token]
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, token)]
+                for gram in trigrams(token):
+                    self._trigrams[gram].discard(token)
+
+    def update_products(self, session: Session, ids: Iterable[int]):
+        """
+        Reindexes products after they were created or updated, and drops the ones that no longer exist.
+        """
+        if not self.built:
+            return
+        ids = set(ids)
+        rows = session.execute(
+            select(models.Product.id, models.Product.name, models.Product.image, models.Product.price,
+                   models.Product.details_id, models.Product.manufacturer_id)
+            .where(models.Product.id.in_(ids))
+        ).all()
+        with self._lock:
+            for id in ids:
+                self._remove(id)
+            for row in rows:
+                self._add(*row)
+
+    def update_manufacturers(self, session: Session, ids: Iterable[int]):
+        """
+        Reindexes the products of manufacturers that were created, renamed or deleted.
+        """
+        if not self.built:
+            return
+        ids = set(ids)
+        names = dict(session.execute(
+            select(models.Manufacturer.id, models.Manufacturer.name).where(models.Manufacturer.id.in_(ids))
+        ).all())
+        with self._lock:
+            for id in ids:
+                if id in names:
+                    self._manufacturers[id] = names[id]
+                else:
+                    self._manufacturers.pop(id, None)
+            affected = [document.id for document in self._documents.values() if document.manufacturer_id in ids]
+        self.update_products(session, affected)
+
+    def update_details(self, session: Session, ids: Iterable[int]):
+        """
+        Reindexes the products of written nutrition details. The details aren't indexed, but deleting them
+        cascades to their product.
+        """
+        if not self.built:
+            return
+        ids = set(ids)
+        with self._lock:
+            affected = [document.id for document in self._documents.values() if document.details_id in ids]
+        self.update_products(session, affected)
+
+    # queries
+
+    def _expand(self, term: str, prefix: bool) -> Dict[str, float]:
+        """
+        Finds the vocabulary tokens a query term matches, with the score of each match.
+        """
+        matches = {}
+        if term in self._postings:
+            matches[term] = EXACT_SCORE
+
+        if prefix:
+            start = bisect.bisect_left(self._vocabulary, term)
+            end = bisect.bisect_left(self._vocabulary, term + "\uffff", start, min(start + MAX_PREFIX_SCAN, len(self._vocabulary)))
+            tokens = self._vocabulary[start:end]
+            if len(tokens) > MAX_EXPANSIONS:  # keep the tokens used by the most products
+                tokens = heapq.nlargest(MAX_EXPANSIONS, tokens, key=lambda token: sum(map(len, self._postings[token].values())))
+            for token in tokens:
+                matches.setdefault(token, PREFIX_SCORE * len(term) / len(token))
+
+        if len(term) >= MIN_FUZZY_LENGTH:
+            # candidates share trigrams with the term, the most shared first
+            counts: Dict[str, int] = {}
+            for gram in trigrams(term):
+                for token in self._trigrams.get(gram, ()):
+                    counts[token] = counts.get(token, 0) + 1
+            limit = 1 if len(term) < 6 else 2
+            for token in heapq.nlargest(MAX_EXPANSIONS, counts, key=counts.get):
+                if token in matches:
+                    continue
+                distance = edit_distance(term, token[:len(term)] if prefix else token, limit)  # while typing, compare with the start of the token
+                if distance <= limit:
+                    matches[token] = FUZZY_SCORE / (1 + distance)
+        return matches
+
+    def search(self, query: str, limit: int = 10) -> List[dict]:
+        """
+        Ranks products by how well their names match every term of the query.
+        The last term is matched as a prefix, unless the query ends with a space.
+
+        Args:
+            query (str): Search text.
+            limit (int): Maximum number of results.
+
+        Returns:
+            List[dict]: Product summaries with their score, best first.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+        typing = not query[-1].isspace()
+
+        with self._lock:
+            scores: Optional[Dict[int, float]] = None
+            for index, term in enumerate(terms):
+                expansions = self._expand(term, prefix=typing and index == len(terms) - 1)
+
+                # every product in a posting set gets the same score, so the sets are scored as a whole,
+                # lowest first so a product matching several tokens keeps its best score
+                groups = sorted(
+                    (score * weight, ids)
+                    for token, score in expansions.items()
+                    for weight, ids in self._postings[token].items()
+                )
+                term_scores: Dict[int, float] = {}
+                for score, ids in groups:
+                    term_scores.update(dict.fromkeys(ids, score))
+
+                if scores is None:
+                    scores = term_scores
+                else:  # every term has to match
+                    if len(term_scores) < len(scores):
+                        scores, term_scores = term_scores, scores
+                    scores = {id: score + term_scores[id] for id, score in scores.items() if id in term_scores}
+                if not scores:
+                    return []
+
+            best = heapq.nlargest(limit, scores, key=scores.get)
+            best.sort(key=lambda id: (-scores[id], self._documents[id].name))
+            return [self._documents[id].summary(scores[id]) for id in best]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "built": self.built,
+                "products": len(self._documents),
+                "tokens": len(self._vocabulary),
+                "trigrams": len(self._trigrams),
+            }
@@ -0,0 +1,103 @@
+import time
+from operator import attrgetter
+from typing import Callable, Dict, List, Optional, Tuple
+from sqlalchemy.inspection import inspect as sa_inspect
+import metrics
+import models
+
+MAX_COMPILED = 1024  # mapper lists come from request bodies, so the cache is bounded
+
+# compiled serializers, keyed by (table class, mapper paths)
+_compiled: Dict[Tuple[type, Tuple[str, ...]], Callable] = {}
+
+
+def sub_mappers(name: str, mappers: Tuple[str, ...]) -> Tuple[str, ...]:
+    """
+    Strips a mapper name from the start of the mapper paths nested below it,
+    e.g. "orders" turns ("orders", "orders.order_products") into ("order_products",).
+    """
+    prefix = f"{name}."
+    return tuple(
+        mapper[len(prefix):]
+        for mapper in mappers
+        if mapper.startswith(prefix)
+    )
+
+
+def compile_serializer(cls: type, mappers: Tuple[str, ...]) -> Callable:
+    """
+    Builds a serializer function for a table class and a set of mapper paths.
+    Column names, relationship lookups and nested serializers are resolved once here,
+    so serializing a row is only attribute reads and dict construction.
+
+    Args:
+        cls (type): SQLAlchemy model class.
+        mappers (Tuple[str]): Dotted mapper paths to include.
+
+    Returns:
+        Callable: Function taking a model instance and returning a dictionary.
+    """
+    table = models.TABLES_GET(cls.__tablename__)
+    names = tuple(c.name for c in table.columns)
+    getter = attrgetter(*names)
+    if len(names) == 1:  # attrgetter with a single name doesn't return a tuple
+        single = getter
+        getter = lambda inst: (single(inst),)
+
+    relationships = sa_inspect(cls).relationships
+    nested = []
+    for mapper in dict.fromkeys(mappers):  # keep order, drop duplicates
+        relationship = relationships.get(mapper)
+        if relationship is None:  # nested paths and non relationship fields are skipped
+            continue
+        serializer = get_serializer(relationship.mapper.class_, sub_mappers(mapper, mappers))
+        nested.append((mapper, attrgetter(mapper), serializer, relationship.uselist))
+
+    if not nested:
+        def serialize(inst):
+            return dict(zip(names, getter(inst)))
+        return serialize
+
+    def serialize(inst):
+        data = dict(zip(names, getter(inst)))
+        for mapper, get, serializer, uselist in nested:
+            value = get(inst)
+            if uselist:
+                data[mapper] = [serializer(item) for item in value]
+            else:
+                data[mapper] = serializer(value) if value is not None else None
+        return data
+    return serialize
+
+
+def get_serializer(cls: type, mappers: Optional[List[str]] = None) -> Callable:
+    """
+    Returns the cached serializer for a table class and mapper paths, compiling it on first use.
+
+    Args:
+        cls (type): SQLAlchemy model class.
+        mappers (List[str]): Dotted mapper paths to include.
+
+    Returns:
+        Callable: Function taking a model instance and returning a dictionary.
+    """
+    key = (cls, tuple(mappers or ()))
+    serializer = _compiled.get(key)
+    if serializer is None:
+        if len(_compiled) >= MAX_COMPILED:
+            _compiled.clear()
+        serializer = _compiled[key] = compile_serializer(cls, key[1])
+    return serializer
+
+
+def serialize_all(items, mappers: Optional[List[str]] = None) -> list:
+    """
+    Serializes a list of rows of the same table class with a single compiled serializer.
+    """
+    if not items:
+        return []
+    start = time.perf_counter()
+    serializer = get_serializer(type(items[0]), mappers)
+    data = [serializer(item) for item in items]
+    metrics.record_serialization(time.perf_counter() - start)
+    return data
@@ -0,0 +1,148 @@
+"""
+Pre-fork server for production: prepares the database once in the master process, then forks worker processes
+that accept connections from one shared listening socket, each handling requests on a fixed pool of threads.
+From the Backend folder:
+
+    python serve.py --workers 4 --threads 8 --port 5000
+
+Environment (the options override them):
+    WORKERS:           worker processes (default cpu count)
+    THREADS:           request threads per worker (default 8)
+    HOST, PORT:        address to listen on (default 127.0.0.1:5000)
+    GRACEFUL_TIMEOUT:  [s] time running requests get to finish on shutdown (default 30)
+    METRICS_DIR:       folder the workers share their metrics through (default a new temp folder)
+    DB_STARTUP:        keep, seed or reset the database, see backend.init_database
+
+SIGTERM or SIGINT stops accepting connections, lets running requests finish and exits.
+Workers that exit unexpectedly are replaced.
+"""
+import argparse
+import os
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+BACKLOG = 1024  # connections waiting to be accepted
+POLL_INTERVAL = 0.2  # [s] how often the master checks on its workers
+RESTART_DELAY = 1.0  # [s] pause before replacing a worker that exited, so a crashing worker doesn't spin
+
+
+class RequestHandler(WSGIRequestHandler):
+    # one request per connection, an idle keep-alive connection would hold one of the pool's threads
+    protocol_version = "HTTP/1.0"
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """
+    Werkzeug server handling connections on a fixed pool of threads, instead of a new thread per request.
+    """
+    multithread = True
+
+    def __init__(self, host: str, port: int, app, threads: int, fd: int):
+        super().__init__(host, port, app, handler=RequestHandler, fd=fd)
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="request")
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        if getattr(self, "executor", None) is not None:
+            self.executor.shutdown(wait=True)  # running requests finish first
+        super().server_close()
+
+
+def run_worker(backend, listener: socket.socket, host: str, port: int, threads: int):
+    """
+    Serves requests in a forked worker until SIGTERM, then finishes the running requests and releases resources.
+    """
+    backend.after_fork()
+    server = PooledWSGIServer(host, port, backend.app, threads, listener.fileno())
+
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown).start()  # shutdown waits for serve_forever, so not from its thread
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the master handles Ctrl+C for the whole process group
+
+    server.serve_forever()
+    server.server_close()
+    backend.shutdown()
+
+
+def spawn(backend, listener: socket.socket, host: str, port: int, threads: int) -> int:
+    pid = os.fork()
+    if pid:
+        return pid
+    status = 0
+    try:
+        run_worker(backend, listener, host, port, threads)
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+        status = 1
+    finally:
+        os._exit(status)  # never return into the master's code
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WORKERS", os.cpu_count() or 1)))
+    parser.add_argument("--threads", type=int, default=int(os.environ.get("THREADS", 8)))
+    parser.add_argument("--host", default=os.environ.get("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 5000)))
+    parser.add_argument("--graceful-timeout", type=float, default=float(os.environ.get("GRACEFUL_TIMEOUT", 30)))
+    args = parser.parse_args()
+
+    # the workers add up their metrics through files in this folder, see metrics.py
+    if not os.environ.get("METRICS_DIR"):
+        os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix="metrics-")
+
+    # once, in the master: the app, the schema and the seed data
+    import backend
+    backend.init_database()
+    backend.dbcontext.close()  # the workers open their own connections
+
+    listener = socket.create_server((args.host, args.port), backlog=BACKLOG)
+    listener.set_inheritable(True)
+    workers = {spawn(backend, listener, args.host, args.port, args.threads) for _ in range(args.workers)}
+    print(f"Serving on http://{args.host}:{args.port} with {args.workers} workers x {args.threads} threads", file=sys.stderr)
+
+    stopping = []
+    def stop(signum, frame):
+        if not stopping:
+            stopping.append(time.monotonic())
+            for pid in workers:
+                os.kill(pid, signal.SIGTERM)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while workers:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid == 0:
+            if stopping and time.monotonic() - stopping[0] > args.graceful_timeout:
+                for pid in workers:
+                    os.kill(pid, signal.SIGKILL)
+            time.sleep(POLL_INTERVAL)
+            continue
+        workers.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, replacing it", file=sys.stderr)
+            time.sleep(RESTART_DELAY)
+            workers.add(spawn(backend, listener, args.host, args.port, args.threads))
+    listener.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+import threading
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+import models
+
+# nutrition columns compared, per serving
+FEATURES = ["calories", "protein", "fat", "sodium", "fiber", "carbohydrates", "sugars", "potassium", "vitamins"]
+MAX_NEIGHBORS = 20  # neighbors kept per product, the most a query can ask for
+BLOCK_SIZE = 256  # rows per block of the pairwise distance computation, bounds its memory to BLOCK_SIZE x products
+INITIAL_CAPACITY = 64
+
+
+class SimilarityIndex:
+    """
+    Nearest neighbors of every product by nutrition, for "similar cereals" recommendations.
+    The nutrition values are standardized (the cereal data uses -1 for unknown values, those count as average),
+    and products are compared by euclidean distance. Each product's MAX_NEIGHBORS nearest products are
+    precomputed, so a query is a lookup. Writes update the affected neighbor lists instead of rebuilding.
+    Built from the database on first use and kept current by the write endpoints.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.built = False
+        self.version = None  # catalog version the index reflects, kept by backend.current_index
+        self._mean = np.zeros(len(FEATURES))  # standardization, fixed when the index is built
+        self._scale = np.ones(len(FEATURES))
+        self._products: Dict[int, dict] = {}  # id -> summary, details_id and manufacturer_id
+        self._rows: Dict[int, int] = {}  # product id -> matrix row
+        self._free: List[int] = []  # rows of deleted products, reused by new ones
+        self._ids = np.full(0, -1, dtype=np.int64)  # matrix row -> product id, -1 if free
+        self._matrix = np.zeros((0, len(FEATURES)), dtype=np.float32)  # standardized vectors
+        self._neighbors = np.zeros((0, MAX_NEIGHBORS), dtype=np.int64)  # nearest rows, -1 padded
+        self._distances = np.zeros((0, MAX_NEIGHBORS), dtype=np.float32)  # their squared distances, inf padded
+
+    # index maintenance
+
+    @staticmethod
+    def _select(session: Session, where=None) -> list:
+        query = (
+            select(models.Product.id, models.Product.name, models.Product.image, models.Product.price,
+                   models.Product.manufacturer_id, models.Product.details_id,
+                   *(getattr(models.ProductDetails, feature) for feature in FEATURES))
+            .join(models.ProductDetails, models.Product.details_id == models.ProductDetails.id)
+        )
+        if where is not None:
+            query = query.where(where)
+        return session.execute(query).all()
+
+    @staticmethod
+    def _raw(rows: list) -> np.ndarray:
+        values = np.array([row[6:] for row in rows], dtype=np.float64).reshape(len(rows), len(FEATURES))
+        values[values < 0] = np.nan  # unknown
+        return values
+
+    def _standardize(self, values: np.ndarray) -> np.ndarray:
+        return np.nan_to_num((values - self._mean) / self._scale).astype(np.float32)
+
+    def _remember(self, row: tuple):
+        id, name, image, price, manufacturer_id, details_id = row[:6]
+        self._products[id] = {
+            "summary": {"id": id, "name": name, "image": image, "price": price, "manufacturer_id": manufacturer_id},
+            "details_id": details_id,
+            "manufacturer_id": manufacturer_id,
+        }
+
+    def build(self, session: Session):
+        """
+        (Re)builds the index from the database, computing all pairwise distances in blocks.
+        """
+        rows = self._select(session)
+        values = self._raw(rows)
+        with self._lock:
+            if rows:
+                self._mean = np.nan_to_num(np.nanmean(values, axis=0))
+                scale = np.nan_to_num(np.nanstd(values, axis=0))
+                self._scale = np.where(scale > 0, scale, 1.0)
+            count = len(rows)
+            self._matrix = self._standardize(values)
+            self._ids = np.array([row[0] for row in rows], dtype=np.int64)
+            self._rows = {id: index for index, id in enumerate(self._ids.tolist())}
+            self._free = []
+            self._products.clear()
+            for row in rows:
+                self._remember(row)
+            self._neighbors = np.full((count, MAX_NEIGHBORS), -1, dtype=np.int64)
+            self._distances = np.full((count, MAX_NEIGHBORS), np.inf, dtype=np.float32)
+            self._refresh(np.arange(count))
+            self.built = True
+
+    def ensure_built(self, session: Session):
+        if not self.built:
+            self.build(session)
+
+    def invalidate(self):
+        """
+        Marks the index for a full rebuild on the next query, for writes that don't report their ids.
+        """
+        self.built = False
+
+    def _squared_distances(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Squared distances from the given rows to every row, inf for free rows and each row to itself.
+        """
+        vectors = self._matrix[rows]
+        distances = (
+            (vectors ** 2).sum(axis=1)[:, None]
+            + (self._matrix ** 2).sum(axis=1)[None, :]
+            - 2 * vectors @ self._matrix.T
+        )
+        np.maximum(distances, 0, out=distances)  # rounding can make identical vectors slightly negative
+        distances[:, self._ids < 0] = np.inf
+        distances[np.arange(len(rows)), rows] = np.inf
+        return distances
+
+    def _refresh(self, rows: np.ndarray):
+        """
+        Recomputes the neighbor lists of the given rows against every row, BLOCK_SIZE rows at a time.
+        """
+        k = min(MAX_NEIGHBORS, max(len(self._ids) - 1, 0))
+        for start in range(0, len(rows), BLOCK_SIZE):
+            block = rows[start:start + BLOCK_SIZE]
+            self._neighbors[block] = -1
+            self._distances[block] = np.inf
+            if k == 0:
+                continue
+            distances = self._squared_distances(block)
+            nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            nearest_distances = np.take_along_axis(distances, nearest, axis=1)
+            order = np.argsort(nearest_distances, axis=1, kind="stable")
+            nearest = np.take_along_axis(nearest, order, axis=1)
+            nearest_distances = np.take_along_axis(nearest_distances, order, axis=1)
+            nearest[np.isinf(nearest_distances)] = -1  # fewer products than neighbors
+            self._neighbors[block, :k] = nearest
+            self._distances[block, :k] = nearest_distances
+
+    def _grow(self):
+        capacity = max(INITIAL_CAPACITY, 2 * len(self._ids))
+        extra = capacity - len(self._ids)
+        self._free.extend(range(capacity - 1, len(self._ids) - 1, -1))  # lowest row is popped first
+        self._ids = np.concatenate([self._ids, np.full(extra, -1, dtype=np.int64)])
+        self._matrix = np.concatenate([self._matrix, np.zeros((extra, len(FEATURES)), dtype=np.float32)])
+        self._neighbors = np.concatenate([self._neighbors, np.full((extra, MAX_NEIGHBORS), -1, dtype=np.int64)])
+        self._distances = np.concatenate([self._distances, np.full((extra, MAX_NEIGHBORS), np.inf, dtype=np.float32)])
+
+    def _remove(self, ids: Iterable[int]) -> np.ndarray:
+        """
+        Frees the rows of products, and returns the rows whose neighbor lists referred to them.
+        """
+        removed = [self._rows.pop(id) for id in ids if id in self._rows]
+        for id in ids:
+            self._products.pop(id, None)
+        if not removed:
+            return np.zeros(0, dtype=np.int64)
+        removed = np.array(removed, dtype=np.int64)
+        self._ids[removed] = -1
+        self._neighbors[removed] = -1
+        self._distances[removed] = np.inf
+        self._free.extend(removed.tolist())
+        return np.flatnonzero(np.isin(self._neighbors, removed).any(axis=1))
+
+    def _add(self, rows: list):
+        """
+        Stores products in free rows and computes their neighbor lists, then inserts them into the
+        neighbor lists of existing products they are closer to than their current farthest neighbor.
+        """
+        if not rows:
+            return
+        vectors = self._standardize(self._raw(rows))
+        added = []
+        for row, vector in zip(rows, vectors):
+            if not self._free:
+                self._grow()
+            index = self._free.pop()
+            self._ids[index] = row[0]
+            self._matrix[index] = vector
+            self._rows[row[0]] = index
+            self._remember(row)
+            added.append(index)
+        added = np.array(added, dtype=np.int64)
+        self._refresh(added)
+
+        # the new products as candidates for everyone else's lists
+        distances = self._squared_distances(added).T  # rows x added
+        distances[added] = np.inf  # the new rows' own lists are already complete
+        closer = np.flatnonzero((distances < self._distances[:, -1:]).any(axis=1))
+        for index in closer:
+            candidates = np.concatenate([self._neighbors[index], added])
+            candidate_distances = np.concatenate([self._distances[index], distances[index]])
+            order = np.argsort(candidate_distances, kind="stable")[:MAX_NEIGHBORS]
+            self._neighbors[index] = np.where(np.isinf(candidate_distances[order]), -1, candidates[order])
+            self._distances[index] = candidate_distances[order]
+
+    def update_products(self, session: Session, ids: Iterable[int]):
+        """
+        Reindexes products after they were created or updated, and drops the ones that no longer exist.
+        """
+        if not self.built:
+            return
+        ids = set(ids)
+        rows = self._select(session, models.Product.id.in_(ids))
+        with self._lock:
+            stale = self._remove(ids)
+            self._add(rows)
+            stale = np.array([row for row in stale.tolist() if self._ids[row] >= 0], dtype=np.int64)
+            self._refresh(stale)  # lost a neighbor, find the next nearest
+
+    def update_details(self, session: Session, ids: Iterable[int]):
+        """
+        Reindexes the products whose nutrition details were updated.
+        """
+        ids = set(ids)
+        with self._lock:
+            affected = [id for id, product in self._products.items() if product["details_id"] in ids]
+        self.update_products(session, affected)
+
+    def update_manufacturers(self, session: Session, ids: Iterable[int]):
+        """
+        Reindexes the products of manufacturers that were changed or deleted, deletes cascade to their products.
+        """
+        ids = set(ids)
+        with self._lock:
+            affected = [id for id, product in self._products.items() if product["manufacturer_id"] in ids]
+        self.update_products(session, affected)
+
+    # queries
+
+    def similar(self, id: int, k: int = 5) -> Optional[List[dict]]:
+        """
+        The k products with the most similar nutrition.
+
+        Args:
+            id (int): Product id.
+            k (int): Number of products, at most MAX_NEIGHBORS.
+
+        Returns:
+            List[dict] | None: Product summaries with their distance, nearest first. None if the product doesn't exist.
+        """
+        if not 1 <= k <= MAX_NEIGHBORS:
+            raise ValueError(f"k must be between 1 and {MAX_NEIGHBORS}")
+        with self._lock:
+            row = self._rows.get(id)
+            if row is None:
+                return None
+            neighbors = self._neighbors[row, :k]
+            neighbors = neighbors[neighbors >= 0]
+            # exact distances for the few returned products, the precomputed ones lose precision near 0
+            distances = np.linalg.norm(self._matrix[neighbors].astype(np.float64) - self._matrix[row], axis=1)
+            result = []
+            for neighbor, distance in zip(neighbors.tolist(), distances.tolist()):
+                summary = dict(self._products[int(self._ids[neighbor])]["summary"])
+                summary["distance"] = round(distance, 4)
+                result.append(summary)
+            return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "built": self.built,
+                "products": len(self._rows),
+                "capacity": len(self._ids),
+                "neighbors": MAX_NEIGHBORS,
+            }
@@ -0,0 +1,164 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+import polars as pl
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+import cache
+import models
+
+PRODUCT_COLUMNS = [column.name for column in models.TABLES_GET("product").columns]
+DETAIL_COLUMNS = [column.name for column in models.TABLES_GET("product_details").columns if column.name != "id"]
+
+TABLES = ("manufacturer", "product", "product_details")  # a write to any of these refreshes the snapshot
+STOCK = "product_stock"  # bumped together with "product" by orders, which only change the stock column
+
+# the operator vocabulary of filter_build, as polars expressions
+OPERATORS = {
+    '>': lambda column, value: column > value,
+    '<': lambda column, value: column < value,
+    '>=': lambda column, value: column >= value,
+    '<=': lambda column, value: column <= value,
+    '==': lambda column, value: column == value,
+    '!=': lambda column, value: column != value,
+    "in": lambda column, value: column.is_in(value),
+    "not_in": lambda column, value: ~column.is_in(value),
+    "range": lambda column, value: column.is_between(*value),  # inclusive, like BETWEEN
+}
+DEFAULT_OPERATOR = '=='
+
+
+def coerce(dtype: pl.DataType, value):
+    """
+    Converts a filter value to the column's type, filters may send numbers as strings.
+    """
+    if isinstance(value, list):
+        return [coerce(dtype, item) for item in value]
+    if dtype == pl.Boolean and isinstance(value, str):
+        return value.lower() in ("1", "true")
+    if dtype.is_integer():
+        return int(value)
+    if dtype.is_float():
+        return float(value)
+    return value
+
+
+class CatalogSnapshot:
+    """
+    Column oriented copy of the catalog: every product with its nutrition details and manufacturer,
+    in one polars frame. Storefront filters are evaluated on it as vectorized expressions, without the database.
+    The snapshot is rebuilt on the first query after a write to the catalog tables,
+    except after orders, which only have the stock column read again.
+    """
+    def __init__(self, versions: cache.TableVersions):
+        self.versions = versions
+        self._lock = threading.Lock()
+        self._frame: Optional[pl.DataFrame] = None
+        self._snapshot: Optional[Tuple] = None  # table versions the frame was built at
+
+    def build(self, session: Session) -> pl.DataFrame:
+        snapshot = self.versions.snapshot((STOCK, *TABLES))  # before reading, so writes during the build trigger another one
+        product, details, manufacturer = models.Product.__table__, models.ProductDetails.__table__, models.Manufacturer.__table__
+        rows = session.execute(
+            select(
+                *(product.c[name] for name in PRODUCT_COLUMNS),
+                *(details.c[name] for name in DETAIL_COLUMNS),
+                manufacturer.c.name,
+            )
+            .join(details, product.c.details_id == details.c.id)
+            .join(manufacturer, product.c.manufacturer_id == manufacturer.c.id)
+            .order_by(product.c.id)
+        ).all()
+        frame = pl.DataFrame(rows, schema=PRODUCT_COLUMNS + DETAIL_COLUMNS + ["manufacturer_name"], orient="row")
+        with self._lock:
+            self._frame, self._snapshot = frame, snapshot
+        return frame
+
+    def frame(self, session: Session) -> pl.DataFrame:
+        """
+        The current snapshot, rebuilt first if the catalog changed since it was taken.
+        """
+        with self._lock:
+            frame, snapshot = self._frame, self._snapshot
+        if frame is None:
+            return self.build(session)
+        current = self.versions.snapshot((STOCK, *TABLES))  # stock first, see stock_only
+        if current == snapshot:
+            return frame
+        if self.stock_only(snapshot, current):
+            return self.refresh_stock(session, frame, current)
+        return self.build(session)
+
+    @staticmethod
+    def stock_only(before: Tuple, after: Tuple) -> bool:
+        """
+        Whether every catalog write between two snapshots was an order. Orders bump STOCK and "product" at once,
+        and STOCK is read first, so the counts only match if no other write to product happened meanwhile.
+        """
+        before, after = dict(before), dict(after)
+        if any(before[table] != after[table] for table in TABLES if table != "product"):
+            return False
+        return after["product"] - before["product"] == after[STOCK] - before[STOCK]
+
+    def refresh_stock(self, session: Session, frame: pl.DataFrame, snapshot: Tuple) -> pl.DataFrame:
+        """
+        Reads the stock of every product again and replaces the stock column of the frame.
+        """
+        product = models.Product.__table__
+        rows = session.execute(select(product.c.id, product.c.stock)).all()
+        stock = pl.DataFrame(rows, schema={"id": frame.schema["id"], "stock": frame.schema["stock"]}, orient="row")
+        frame = frame.drop("stock").join(stock, on="id", how="left").select(frame.columns).sort("id")
+        with self._lock:
+            self._frame, self._snapshot = frame, snapshot
+        return frame
+
+    @staticmethod
+    def expression(frame: pl.DataFrame, filters: Dict) -> pl.Expr:
+        """
+        Builds one polars expression from filters written like the filter_build JSON filters.
+        """
+        expressions = [pl.lit(True)]
+        for key, value in filters.items():
+            if isinstance(value, list):
+                operator, value = value
+            else:
+                operator = DEFAULT_OPERATOR
+            if operator not in OPERATORS:
+                raise ValueError(f"Unsupported operator: {operator}")
+            if key not in frame.columns:
+                raise ValueError(f"Invalid filter key: {key}")
+            if operator == "range" and not (isinstance(value, list) and len(value) == 2):
+                raise ValueError(f"Invalid range for: {key}")
+            expressions.append(OPERATORS[operator](pl.col(key), coerce(frame.schema[key], value)))
+        return pl.all_horizontal(expressions)
+
+    def query(self, session: Session, filters: Dict, facets: Optional[List[str]] = None) -> Tuple[List[dict], Optional[dict]]:
+        """
+        Filters the catalog and serializes the matching products,
+        shaped like get_items on product with the mappers details and manufacturer.
+
+        Args:
+            session (Session): Used only if the snapshot has to be rebuilt.
+            filters (dict): JSON filters, keys are product or nutrition columns.
+            facets (List[str]): Columns to count the matching products by.
+
+        Returns:
+            Tuple[List[dict], dict | None]: The products, and the value counts per facet column.
+        """
+        frame = self.frame(session)
+        matches = frame.filter(self.expression(frame, filters))
+
+        items = matches.select(
+            *PRODUCT_COLUMNS,
+            pl.struct(pl.col("details_id").alias("id"), *DETAIL_COLUMNS).alias("details"),
+            pl.struct(pl.col("manufacturer_id").alias("id"), pl.col("manufacturer_name").alias("name")).alias("manufacturer"),
+        ).to_dicts()
+
+        counts = None
+        if facets is not None:
+            counts = {}
+            for facet in facets:
+                if facet not in frame.columns:
+                    raise ValueError(f"Invalid facet: {facet}")
+                grouped = matches.group_by(facet).len().sort(facet)
+                counts[facet] = dict(zip(map(str, grouped[facet].to_list()), grouped["len"].to_list()))
+        return items, counts
@@ -0,0 +1,59 @@
+from flask import Response, current_app, stream_with_context
+from typing import List
+import serializers
+
+BATCH_SIZE = 1000  # rows fetched from the database and written to the response at a time
+
+# streaming formats and their content types
+STREAM_FORMATS = {
+    "ndjson": "application/x-ndjson",  # one JSON object per line
+    "json_stream": "application/json",  # a regular JSON array, written in chunks
+}
+
+
+def stream_response(query, session_factory, mappers: List[str], format: str, batch_size: int = BATCH_SIZE) -> Response:
+    """
+    Streams the rows of a query as they're fetched, instead of building the full result in memory.
+    The query runs in its own session, since the request's session is closed before the body is sent.
+
+    Args:
+        query (Query): The query to stream, filters and loader options already applied.
+        session_factory (Callable): Returns a new session to run the query in.
+        mappers (List[str]): Mapper paths to serialize with each row.
+        format (str): One of STREAM_FORMATS.
+        batch_size (int): Rows per database fetch and per written chunk.
+
+    Returns:
+        Response: A chunked response.
+    """
+    dumps = current_app.json.dumps  # same encoding of dates etc. as jsonify
+    serializer = serializers.get_serializer(query.column_descriptions[0]["entity"], mappers)
+    ndjson = format == "ndjson"
+
+    def generate():
+        session = session_factory()
+        try:
+            if not ndjson:
+                yield "["
+            first = True
+            chunk = []
+            for row in query.with_session(session).yield_per(batch_size):
+                line = dumps(serializer(row))
+                if ndjson:
+                    chunk.append(line + "\n")
+                else:
+                    chunk.append(line if first else "," + line)
+                    first = False
+
+                if len(chunk) >= batch_size:
+                    yield "".join(chunk)
+                    chunk = []
+            if chunk:
+                yield "".join(chunk)
+            if not ndjson:
+                yield "]"
+        finally:
+            session.rollback()  # read only, nothing to commit
+            session.close()
+
+    return Response(stream_with_context(generate()), 200, mimetype=STREAM_FORMATS[format])
@@ -0,0 +1,18 @@
+"""
+Runs the tests against a throwaway SQLite file instead of the database in dbinfo.py. From the Backend folder:
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+import tempfile
+import types
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+# before anything imports dbcontext, which connects on import
+sys.modules["dbinfo"] = types.SimpleNamespace(
+    connection_string=f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='backend-tests-'), 'test.db')}",
+)
+os.environ.setdefault("BCRYPT_WORKERS", "0")  # hash in the request thread, no process pool in tests
@@ -0,0 +1,64 @@
+"""
+The mapped reads must take a fixed number of queries, however many rows they return (no N+1 lazy loads).
+Each case runs against two catalogs of different sizes and counts the statements the requests execute.
+"""
+import pytest
+from sqlalchemy import event
+import backend
+import datagen
+
+CATALOG_QUERIES = 1  # products, manufacturers and details joined
+USER_INFO_QUERIES = 4  # user_required's user, the user, the orders page, their order lines
+USER_INFO_PRODUCT_QUERIES = 4  # the same, the ordered products are joined to the order lines
+
+
+@pytest.fixture(params=[1, 3], ids=["small", "large"])
+def client(request):
+    """
+    A test client logged in as customer1, on a freshly generated catalog of request.param copies of cereal.csv,
+    with orders growing along.
+    """
+    factor = request.param
+    backend.dbcontext.clear_database()
+    with backend.dbcontext.get_session() as session:
+        datagen.generate(session, factor=factor, users=2, orders=15 * factor)
+        session.commit()
+    backend.table_versions.bump(*backend.Base.metadata.tables)
+    backend.result_cache.clear()
+    client = backend.app.test_client()
+    assert client.post('/api/login', json={"email": "customer1@example.com", "password": "123"}).status_code == 200
+    return client
+
+
+@pytest.fixture
+def queries():
+    """
+    Counts the statements executed while the fixture is alive.
+    """
+    count = [0]
+    def listener(*args):
+        count[0] += 1
+    event.listen(backend.dbcontext.engine, "before_cursor_execute", listener)
+    yield count
+    event.remove(backend.dbcontext.engine, "before_cursor_execute", listener)
+
+
+def test_catalog_with_manufacturer_and_details(client, queries):
+    response = client.post('/api/get/product', json={"mappers": ["manufacturer", "details"]})
+    assert response.status_code == 200
+    assert all(product["manufacturer"] and product["details"] for product in response.json)
+    assert queries[0] == CATALOG_QUERIES
+
+
+def test_user_info_with_order_lines(client, queries):
+    response = client.get('/api/user/info')
+    assert response.status_code == 200
+    assert any(order["order_products"] for order in response.json["orders"])
+    assert queries[0] == USER_INFO_QUERIES
+
+
+def test_user_info_with_products(client, queries):
+    response = client.get('/api/user/info?products=1')
+    assert response.status_code == 200
+    assert all(line["product"]["name"] for order in response.json["orders"] for line in order["order_products"])
+    assert queries[0] == USER_INFO_PRODUCT_QUERIES
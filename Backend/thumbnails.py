@@ -0,0 +1,211 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from typing import Dict, List, Optional, Tuple
+from flask import Response, send_file
+
+try:
+    from PIL import Image
+except ImportError:  # pinned in requirements.txt, without it the resize endpoint answers 501
+    Image = None
+
+log = logging.getLogger("thumbnails")
+
+# named widths used by the frontend
+PRESETS = {
+    "thumb": 160,
+    "grid": 320,
+    "detail": 640,
+}
+WIDTHS = {80, 160, 240, 320, 480, 640, 960}  # allowed widths, so clients can't fill the cache with arbitrary sizes
+QUALITY = 85  # JPEG quality of resized images
+MAX_AGE = 24 * 60 * 60  # [s] client cache lifetime of resized images
+WAIT = 2.0  # [s] how long a request waits for a resize before falling back to the original image
+TEMP_AGE = 10 * 60  # [s] age after which a temp file is considered left over from an interrupted resize
+
+
+class ResizeUnavailable(Exception):
+    """
+    Raised when an image is requested resized but Pillow isn't installed.
+    """
+    pass
+
+
+def resize(source: str, target: str, width: int):
+    """
+    Resizes an image to a width, keeping its aspect ratio. Images narrower than the width are only re-encoded.
+    Runs in the worker pool. The result is written to a temp file first, so readers never see a partial file.
+    """
+    with Image.open(source) as image:
+        image = image.convert("RGB")
+        if image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.LANCZOS)
+        temp = f"{target}.{threading.get_ident()}.tmp"
+        image.save(temp, "JPEG", quality=QUALITY, optimize=True)
+    os.replace(temp, target)
+
+
+class ThumbnailCache:
+    """
+    Resized image variants, generated once in a thread pool and kept on disk.
+    The cache folder is bounded by max_bytes, evicting the least recently served variants.
+    The folder is shared by the server's worker processes, so its size and recency are read from the filesystem
+    (every hit refreshes the variant's modification time) instead of being tracked per process.
+
+    Environment:
+        THUMBNAIL_CACHE_BYTES:  size of the cache folder (default 256 MiB)
+        THUMBNAIL_WORKERS:      resize threads (default 2)
+    """
+    def __init__(self, image_folder: str, cache_folder: str, max_bytes: int = None, workers: int = None):
+        self.image_folder = image_folder
+        self.cache_folder = cache_folder
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.environ.get("THUMBNAIL_CACHE_BYTES", 256 * 1024 * 1024))
+        self.workers = workers if workers is not None else int(os.environ.get("THUMBNAIL_WORKERS", 2))
+        os.makedirs(cache_folder, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="thumbnail")
+        self._pending: Dict[str, Future] = {}  # resizes in progress, so each variant is generated once per process
+        self._clean()
+        if Image is None:
+            log.warning("Pillow isn't installed, resized image requests will fail with 501 (pip install -r requirements.txt)")
+
+    def _clean(self):
+        # remove temp files left by interrupted resizes, recent ones may still be written by another process
+        for name in os.listdir(self.cache_folder):
+            path = os.path.join(self.cache_folder, name)
+            try:
+                if name.endswith(".tmp") and time.time() - os.stat(path).st_mtime > TEMP_AGE:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _scan(self) -> List[Tuple[float, str, int]]:
+        # (modification time, name, size) of the cached variants, another process may remove files meanwhile
+        entries = []
+        for name in os.listdir(self.cache_folder):
+            if name.endswith(".tmp"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_folder, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, name, stat.st_size))
+        return entries
+
+    @staticmethod
+    def width(preset: Optional[str], width: Optional[str]) -> int:
+        """
+        Resolves the requested width from a preset name or a width in pixels.
+        """
+        if preset is not None:
+            if preset not in PRESETS:
+                raise ValueError(f"Unknown preset: {preset}")
+            return PRESETS[preset]
+        if width is None or not width.isdigit() or int(width) not in WIDTHS:
+            raise ValueError(f"width must be one of {sorted(WIDTHS)}")
+        return int(width)
+
+    def source_path(self, image: str) -> str:
+        """
+        Resolves an image path as stored in Product.image ("static/images/...") to a file in the image folder.
+        """
+        name = image.removeprefix("static/images/")
+        path = os.path.realpath(os.path.join(self.image_folder, name))
+        if not path.startswith(os.path.realpath(self.image_folder) + os.sep) or not os.path.isfile(path):
+            raise FileNotFoundError(image)
+        return path
+
+    def key(self, source: str, width: int) -> str:
+        # the source's size and modification time are part of the key, so a replaced image gets new variants
+        stat = os.stat(source)
+        return hashlib.sha1(f"{source}:{stat.st_size}:{stat.st_mtime_ns}:{width}".encode()).hexdigest() + ".jpg"
+
+    def get(self, source: str, width: int) -> Optional[str]:
+        """
+        Returns the path of the resized variant, generating it if needed.
+        Returns None if the variant isn't ready within WAIT seconds.
+        Raises ResizeUnavailable if Pillow isn't installed, rather than passing off originals as resized images.
+        """
+        if Image is None:
+            raise ResizeUnavailable("Pillow isn't installed, images can't be resized")
+
+        name = self.key(source, width)
+        path = os.path.join(self.cache_folder, name)
+        try:
+            os.utime(path)  # marks it recently served, and checks it wasn't evicted by another process
+            return path
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            future = self._pending.get(name)
+            if future is None:
+                future = self._pending[name] = self._executor.submit(self._generate, source, path, name, width)
+
+        try:
+            future.result(timeout=WAIT)
+        except TimeoutError:
+            return None
+        return path
+
+    def _generate(self, source: str, path: str, name: str, width: int):
+        try:
+            resize(source, path, width)
+            self._evict(name)
+        finally:
+            with self._lock:
+                self._pending.pop(name, None)
+
+    def _evict(self, keep: str):
+        # processes may evict concurrently, removing a file twice is harmless and readers regenerate missing files
+        entries = self._scan()
+        total = sum(size for _, _, size in entries)
+        for _, name, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            try:
+                os.remove(os.path.join(self.cache_folder, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def send(self, image: str, preset: Optional[str], width: Optional[str]) -> Response:
+        """
+        Serves a resized variant of an image, or the original while the variant is being generated.
+        """
+        width = self.width(preset, width)
+        source = self.source_path(image)
+        for _ in range(2):
+            path = self.get(source, width)
+            if path is None:
+                break
+            try:
+                response = send_file(path, mimetype="image/jpeg", max_age=MAX_AGE)
+            except FileNotFoundError:
+                continue  # evicted by another process after get found it, generate it again
+            response.cache_control.public = True
+            return response
+        return send_file(source, max_age=60)  # short lived, the variant will be ready soon
+
+    def shutdown(self):
+        """
+        Waits for running resizes and stops the worker threads.
+        """
+        self._executor.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        entries = self._scan()
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "entries": len(entries),
+            "bytes": sum(size for _, _, size in entries),
+            "max_bytes": self.max_bytes,
+            "pending": pending,
+        }
@@ -93,7 +93,7 @@ function ProductContainer(props: { product: Product }) {
   return <A href={"/product/" + props.product.id}>
     <div class="productContainer">
       <div>
-        <img src={BACKEND_URL+props.product.image}></img>
+        <img src={BACKEND_URL+`api/image/`+props.product.image+`?preset=grid`}></img>
       </div>
       <h3>{props.product.name}</h3>
     </div>
@@ -312,7 +312,7 @@ function CartContainer(props: { remove: () => void, item: CartProduct, product:
         <div class="cartColumn productContainer">
           <h3>{props.product.name}</h3>
           <div>
-            <img src={BACKEND_URL+props.product.image}></img>
+            <img src={BACKEND_URL+`api/image/`+props.product.image+`?preset=thumb`}></img>
           </div>
         </div>
       </A>